@@ -3,7 +3,7 @@ import streamlit as st
 from Bio import SeqIO
 from Bio import pairwise2
 from Bio.pairwise2 import format_alignment
-import requests
+import http_cache
 import pandas as pd
 from bs4 import BeautifulSoup
 import networkx as nx
@@ -13,7 +13,7 @@ import matplotlib.pyplot as plt
 def fetch_protein_data(uniprot_id):
     # Make API request to Uniprot
     url = f"https://www.ebi.ac.uk/proteins/api/proteins/{uniprot_id}"
-    response = requests.get(url)
+    response = http_cache.cached_get(url)
     
     if response.status_code == 200:
         data = response.json()
@@ -26,7 +26,7 @@ def fetch_protein_data(uniprot_id):
 # convert uniprot_id to protein name
 def uniprot_id_to_protein_name(uniprot_id):
     url = f"https://www.uniprot.org/uniprot/{uniprot_id}.xml"
-    response = requests.get(url)
+    response = http_cache.cached_get(url)
     
     # Check if the request was successful
     if response.status_code == 200:
@@ -57,7 +57,7 @@ def retrieve_ppi(uniprot_id):
         "species": 9606  # Homo sapiens
     }
 
-    response = requests.get(string_url, params=params)
+    response = http_cache.cached_get(string_url, params=params)
     data = response.json()
     
     network_df = pd.json_normalize(data)
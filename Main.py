@@ -19,18 +19,21 @@ dessication_protein = f.fetch_proteins('https://rest.uniprot.org/uniprotkb/Q8LAU
 # # ---------------------------------------------------------------------------------------------------------------------
 #
 # # Second, we test protein categorization according to one-of-two-groups
-# # Note this method will take a long time, somewhere around 3-5 minutes, to run
+# # The reference profiles of both groups are built once (they can also be saved with profile.save("file.npz") and loaded later)
+# transmembrane_profile = ca.build_reference_profile(transmembrane_proteins, "Transmembrane")
+# dna_binding_profile = ca.build_reference_profile(dna_binding, "DNA-Binding Proteins")
 # print("Categorization according to one-of-two-groups, by smallest distance:")
-# print(ca.categorize_by_distance(vdac, transmembrane_proteins, dna_binding))
+# print(ca.classify(vdac, transmembrane_profile, dna_binding_profile))
 # print("-----------------------------------------------")
 
 # # To test the accuracy of this method, take the first 10 proteins of the transmembrane protein list and test them against the same list except the first 10 proteins
 # # If the accuracy is 100%, all of them should belong to transmembrane proteins
 #
 # testing_proteins = transmembrane_proteins[:10]
+# training_profile = ca.build_reference_profile(transmembrane_proteins[11:], "Transmembrane (training)")
 # counter = 0
 # for protein in testing_proteins:
-#     result = ca.categorize_by_distance(protein, transmembrane_proteins[11:], dna_binding)
+#     result = ca.classify(protein, training_profile, dna_binding_profile)
 #     if result == "This protein belongs to category 1":
 #         counter += 1
 #     else:
@@ -39,6 +42,11 @@ dessication_protein = f.fetch_proteins('https://rest.uniprot.org/uniprotkb/Q8LAU
 # print("The accuracy is: ",(counter/10) * 100)
 # print("-----------------------------------------------")
 #
+# # The benchmark module cross-validates the method on both lists (5 folds here, or k="loo" for leave-one-out) on every CPU
+# import benchmark
+# print(benchmark.format_report(benchmark.cross_validate({"Transmembrane": transmembrane_proteins, "DNA-Binding": dna_binding}, "categorize_by_distance", k=5, workers=0)))
+# print("-----------------------------------------------")
+#
 # # Testing categorization (natively folded vs. natively unfolded) according to mean hydrophobicity
 # print('Natively Folded/Unfolded according to mean hydrophobicity:')
 # print("4E-binding protein I")
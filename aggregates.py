@@ -0,0 +1,85 @@
+import numpy as np
+
+class RunningStats:
+
+    # Single-pass count / mean / standard deviation / min / max of several named columns (Welford's algorithm)
+    # Values are added a row or a block of rows at a time, so a dataset of any size (or a generator) is only walked once
+    # Two accumulators (e.g. built by different worker processes on different chunks) are combined with merge,
+    # ... using the pairwise update of Chan et al., which gives the same result as accumulating everything in one place
+    # NaN values are skipped, so every column keeps its own count
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+
+    def add(self, row):
+
+        # Adds one value per column (a sequence in the order of columns, or a dictionary keyed by column)
+
+        if isinstance(row, dict):
+            row = [row[column] for column in self.columns]
+        return self.update([row])
+
+    def update(self, values):
+
+        # Adds a block of rows at once: an (n, number of columns) array, or a DataFrame holding the columns
+
+        if hasattr(values, "columns"):
+            values = values[self.columns].to_numpy(dtype=float)
+        values = np.asarray(values, dtype=float).reshape(-1, len(self.columns))
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        mean = np.where(valid, values, 0).sum(axis=0) / np.maximum(count, 1)
+        m2 = np.where(valid, (values - mean) ** 2, 0).sum(axis=0)
+        block = RunningStats(self.columns)
+        block.count = count
+        block.mean = mean
+        block.m2 = m2
+        block.min = np.where(valid, values, np.inf).min(axis=0, initial=np.inf)
+        block.max = np.where(valid, values, -np.inf).max(axis=0, initial=-np.inf)
+        return self.merge(block)
+
+    def merge(self, other):
+
+        # Adds the values of another accumulator over the same columns to this one (and returns it)
+
+        if other.columns != self.columns:
+            raise ValueError("Can not merge statistics of different columns")
+        count = self.count + other.count
+        total = np.maximum(count, 1)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / total
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        return self
+
+    def means(self):
+        return dict(zip(self.columns, np.where(self.count > 0, self.mean, np.nan).tolist()))
+
+    def std(self, ddof=0):
+
+        # Standard deviation of every column; ddof=0 for the population, ddof=1 for the sample standard deviation
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std = np.sqrt(self.m2 / (self.count - ddof))
+        return dict(zip(self.columns, np.where(self.count > ddof, std, np.nan).tolist()))
+
+    def summary(self, ddof=0):
+
+        # {column: {"count", "mean", "std", "min", "max"}}, with NaN statistics for columns without any value
+
+        means = self.means()
+        stds = self.std(ddof)
+        summary = {}
+        for i, column in enumerate(self.columns):
+            empty = self.count[i] == 0
+            summary[column] = {"count": int(self.count[i]), "mean": means[column], "std": stds[column],
+                               "min": np.nan if empty else float(self.min[i]), "max": np.nan if empty else float(self.max[i])}
+        return summary
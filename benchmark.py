@@ -0,0 +1,181 @@
+import time
+import numpy as np
+import pandas as pd
+import parallel
+import categorization as ca
+import characterization as c
+import feature_cache
+
+def cross_validation_folds(n, k=5, seed=0):
+
+    # Splits the indices 0..n-1 into k shuffled test folds of (almost) equal size
+    # k="loo" gives leave-one-out: n folds of one index each
+
+    if k == "loo":
+        return [np.array([i]) for i in range(n)]
+    if not 2 <= k <= n:
+        raise ValueError("k must be between 2 and the number of proteins, or 'loo'")
+    return np.array_split(np.random.default_rng(seed).permutation(n), k)
+
+def categorization_folds(task):
+
+    # Runs categorize_by_distance (through classify_vectors) on a batch of folds, for the process pool of cross_validate
+    # The features of every protein are computed once by cross_validate; for each fold, the reference profiles of the training set are
+    # ... the class sums minus the test proteins, rounded like Avg_Composition / average_pair_composition
+    # Returns (test index, predicted class, seconds) for every test protein; the time is the classification of that protein
+
+    compositions, pair_compositions, classes, folds = task
+    sums = [(compositions[classes == label].sum(axis=0), pair_compositions[classes == label].sum(axis=0), int((classes == label).sum()))
+            for label in (0, 1)]
+    results = []
+    for fold in folds:
+        profiles = []
+        for label, (composition_sum, pair_sum, count) in enumerate(sums):
+            test = fold[classes[fold] == label]
+            training_count = count - len(test)
+            profiles.append(ca.ReferenceProfile(np.round((composition_sum - compositions[test].sum(axis=0)) / training_count, 2),
+                                                np.round((pair_sum - pair_compositions[test].sum(axis=0)) / training_count, 2),
+                                                training_count))
+        for index in fold.tolist():
+            start = time.perf_counter()
+            category = ca.classify_vectors(compositions[index], pair_compositions[index], profiles[0], profiles[1])
+            results.append((index, category - 1, time.perf_counter() - start))
+    return results
+
+def folding_folds(task):
+
+    # Runs folding_state on a batch of folds; it has nothing to train, so the folds only spread the proteins over the process pool
+    # Returns (test index, predicted state, seconds) for every protein
+
+    sequences, folds = task
+    results = []
+    for fold in folds:
+        for index in fold.tolist():
+            start = time.perf_counter()
+            state = ca.folding_state(sequences[index])
+            results.append((index, state, time.perf_counter() - start))
+    return results
+
+def fold_batches(folds, workers):
+
+    # Groups the folds in a few batches per worker, so leave-one-out does not send the features to the pool once per protein
+
+    batches = max(1, min(len(folds), 4 * (parallel.default_workers() if workers == 0 else max(workers, 1))))
+    return [folds[i::batches] for i in range(batches)]
+
+def cross_validate(datasets, method="categorize_by_distance", k=5, workers=1, seed=0):
+
+    # Cross-validation benchmark of a categorization method, reporting correctness and throughput
+    # datasets is {label: list of sequences}:
+    # - for "categorize_by_distance", exactly two labels (category 1 and category 2), the proteins of each fold are categorized
+    # ... against profiles built from all the other proteins
+    # - for "folded_or_unfolded", labels among "folded" / "unfolded" (the answer of folding_state), nothing is trained
+    # k is the number of folds, or "loo" for leave-one-out; the folds run on `workers` processes (0 = one per CPU)
+    # Returns a dictionary: method, folds, queries, accuracy, confusion (DataFrame, true labels as rows, predictions as columns),
+    # ... feature_seconds_per_query (the batch feature_matrix time divided by the number of queries, 0 for folded_or_unfolded),
+    # ... classification_latency_mean / _median / _p95 (seconds per query, classification only: for categorize_by_distance the features
+    # ... are computed beforehand, for folded_or_unfolded it is the whole folding_state call),
+    # ... latency_mean (feature_seconds_per_query + classification_latency_mean) and queries_per_second (of the whole run, features included)
+
+    labels = list(datasets)
+    sequences = [seq for label in labels for seq in datasets[label]]
+    truth = np.array([label for label in labels for seq in datasets[label]])
+    folds = cross_validation_folds(len(sequences), k, seed)
+
+    start = time.perf_counter()
+    feature_seconds = 0
+    if method == "categorize_by_distance":
+        if len(labels) != 2:
+            raise ValueError("categorize_by_distance needs exactly two labelled groups")
+        features = ca.feature_matrix(sequences, "both")
+        feature_seconds = time.perf_counter() - start
+        compositions = features[:, :len(c.amino_acid_list)]
+        pair_compositions = features[:, len(c.amino_acid_list):]
+        classes = np.array([labels.index(label) for label in truth])
+        tasks = [(compositions, pair_compositions, classes, batch) for batch in fold_batches(folds, workers)]
+        function = categorization_folds
+    elif method == "folded_or_unfolded":
+        tasks = [(sequences, batch) for batch in fold_batches(folds, workers)]
+        function = folding_folds
+    else:
+        raise ValueError("Unknown method: " + str(method))
+
+    predictions = np.empty(len(sequences), dtype=object)
+    latencies = np.zeros(len(sequences))
+    for results in parallel.ordered_map(function, tasks, workers):
+        for index, prediction, seconds in results:
+            predictions[index] = labels[prediction] if method == "categorize_by_distance" else prediction
+            latencies[index] = seconds
+    elapsed = time.perf_counter() - start
+
+    feature_seconds_per_query = feature_seconds / len(sequences) if len(sequences) else np.nan
+    return {"method": method, "folds": len(folds), "queries": len(sequences),
+            "accuracy": float((predictions == truth).mean()) if len(sequences) else np.nan,
+            "confusion": pd.crosstab(pd.Series(truth, name="true"), pd.Series(predictions.astype(str), name="predicted")),
+            "feature_seconds_per_query": feature_seconds_per_query,
+            "classification_latency_mean": float(latencies.mean()) if len(sequences) else np.nan,
+            "classification_latency_median": float(np.median(latencies)) if len(sequences) else np.nan,
+            "classification_latency_p95": float(np.percentile(latencies, 95)) if len(sequences) else np.nan,
+            "latency_mean": feature_seconds_per_query + float(latencies.mean()) if len(sequences) else np.nan,
+            "queries_per_second": len(sequences) / elapsed if elapsed > 0 else np.nan}
+
+def format_report(report):
+
+    # Text version of a cross_validate report
+
+    lines = ["Method: " + report["method"],
+             "Folds: " + str(report["folds"]) + " | Queries: " + str(report["queries"]),
+             "Accuracy: " + str(round(report["accuracy"] * 100, 2)) + "%",
+             "Classification latency per query (us, features excluded): mean " + str(round(report["classification_latency_mean"] * 1e6, 1)) +
+             " | median " + str(round(report["classification_latency_median"] * 1e6, 1)) + " | p95 " + str(round(report["classification_latency_p95"] * 1e6, 1)),
+             "Feature computation per query (us): " + str(round(report["feature_seconds_per_query"] * 1e6, 1)),
+             "Latency per query (us, features included): mean " + str(round(report["latency_mean"] * 1e6, 1)),
+             "Throughput: " + str(round(report["queries_per_second"], 1)) + " queries per second",
+             "Confusion matrix:",
+             report["confusion"].to_string()]
+    return "\n".join(lines)
+
+def characterize_protein(seq):
+
+    # The per-protein metrics of characterization.export (num = 1), as a dictionary; this is what cache_benchmark times
+
+    iso = c.isoelectric_point(seq)
+    return {"molecular_weight": c.Protein_Molecular_Weight(seq), "net_charge_pH7": c.total_charge(seq, 7),
+            "isoelectric_point": sum(iso) / len(iso), "hydrophobicity": c.get_total_hydrophobicity(seq),
+            "num_positive_charge": c.num_positive_charge(seq), "percent_positive_charge": c.percent_positive_charge(seq),
+            "num_negative_charge": c.num_negative_charge(seq), "percent_negative_charge": c.percent_negative_charge(seq),
+            "num_hydrophobic": c.num_hydrophobic(seq), "percent_hydrophobic": c.percent_hydrophobic(seq),
+            "num_hydrophilic": c.num_hydrophilic(seq), "percent_hydrophilic": c.percent_hydrophilic(seq),
+            "num_aliphatic": c.num_aliphatic(seq), "percent_aliphatic": c.percent_aliphatic(seq),
+            "num_aromatic": c.num_aromatic(seq), "percent_aromatic": c.percent_aromatic(seq),
+            "occurence": c.AA_Occurence(seq), "composition": c.AA_Composition(seq), "pair_composition": c.pair_composition(seq)}
+
+def cache_benchmark(lengths=(100, 400, 2000), count=300, seed=0):
+
+    # Times characterize_protein over `count` random proteins of every length, in three settings:
+    # - "uncached": the feature cache disabled (max_bytes = 0), every call computes
+    # - "cold": an empty cache, so every protein is a miss (the cost of computing plus storing)
+    # - "warm": the same proteins again, all hits
+    # Returns a DataFrame with one row per length and the seconds of each setting
+    # The shared cache is replaced while it runs, and configured again with its previous budget / directory at the end
+
+    previous = feature_cache.default_cache()
+    rng = np.random.default_rng(seed)
+    letters = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY", dtype=np.uint8)
+    rows = []
+    try:
+        for length in lengths:
+            proteins = [letters[rng.integers(0, len(letters), length)].tobytes().decode("ascii") for _ in range(count)]
+            row = {"length": length, "proteins": count}
+            for setting, max_bytes in [("uncached", 0), ("cold", previous.max_bytes or 64 * 2 ** 20), ("warm", None)]:
+                if max_bytes is not None:
+                    feature_cache.configure(max_bytes)
+                    c.residue_histogram.cache_clear()
+                start = time.perf_counter()
+                for seq in proteins:
+                    characterize_protein(seq)
+                row[setting] = time.perf_counter() - start
+            rows.append(row)
+    finally:
+        feature_cache.configure(previous.max_bytes, previous.directory)
+    return pd.DataFrame(rows)
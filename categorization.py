@@ -1,47 +1,300 @@
+import numpy as np
+import pandas as pd
+import parallel
+from functools import partial
 import characterization as c
+from corpus import SequenceCorpus
 
-def categorize_by_distance(protein_seq, list_of_sequences_1, list_of_sequences_2):
+class ReferenceProfile:
 
-    # This main function serves to categorize a protein into one of two groups
-    # ... by finding the difference between the composition of each amino acid in protein_seq and the average composition of the same amino acid in list_of_sequences_1 and list_of_sequences_2
-    # Those differences are then summed, once for each group
+    # Precompiled reference group for categorize_by_distance: the average amino acid composition and average dipeptide composition
+    # ... of a list of proteins (the centroids of the group), as NumPy vectors in the order of residues / pairs
+    # Building it is the expensive part of a categorization, so a group is built once (build), saved (save) and loaded for every query (load)
+    # A profile built from sequences computes its dipeptide centroid on first use only: most queries are decided by the composition
+
+    def __init__(self, composition, pair_composition, count, name="", residues=None, pairs=None, sequences=None):
+        self.composition = np.asarray(composition, dtype=float)
+        self._pair_composition = np.asarray(pair_composition, dtype=float) if pair_composition is not None else None
+        self.count = int(count)
+        self.name = name
+        self.residues = list(residues) if residues is not None else list(c.amino_acid_list)
+        self.pairs = list(pairs) if pairs is not None else c.kmer_names(2)
+        # The sequences the dipeptide centroid is computed from when pair_composition is None
+        self.sequences = sequences
+
+    @classmethod
+    def build(cls, list_of_sequences, name=""):
+
+        # The centroids are the ones categorize_by_distance always used: Avg_Composition and average_pair_composition
+        # list_of_sequences can be a list or a SequenceCorpus; it is kept until the dipeptide centroid is needed
+
+        composition = c.Avg_Composition(list_of_sequences)
+        return cls(list(composition.values()), None, len(list_of_sequences), name, list(composition.keys()), None, list_of_sequences)
+
+    @property
+    def pair_composition(self):
+        if self._pair_composition is None:
+            pair_composition = c.average_pair_composition(self.sequences)
+            self._pair_composition = np.array(list(pair_composition.values()), dtype=float)
+            self.pairs = list(pair_composition.keys())
+            self.sequences = None
+        return self._pair_composition
+
+    def aligned_to(self, other):
+
+        # This profile with its values in the residue / pair order of another profile, so the two can be compared vector to vector
+        # Raises a ValueError if the two profiles do not have the same residues and pairs
+
+        if self.residues == other.residues and self.pairs == other.pairs:
+            return self
+        if sorted(self.residues) != sorted(other.residues) or sorted(self.pairs) != sorted(other.pairs):
+            raise ValueError("The reference profiles do not have the same residues / pairs")
+        residue_index = {aa: i for i, aa in enumerate(self.residues)}
+        pair_index = {pair: i for i, pair in enumerate(self.pairs)}
+        return ReferenceProfile(self.composition[[residue_index[aa] for aa in other.residues]],
+                                self.pair_composition[[pair_index[pair] for pair in other.pairs]],
+                                self.count, self.name, other.residues, other.pairs)
+
+    def save(self, file):
+
+        # Saves the profile as a NumPy .npz archive (no pickled objects)
+
+        np.savez(file, composition=self.composition, pair_composition=self.pair_composition, count=self.count,
+                 name=np.array(self.name), residues=np.array(self.residues), pairs=np.array(self.pairs))
+        return file
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as archive:
+            return cls(archive["composition"], archive["pair_composition"], archive["count"], str(archive["name"]),
+                       archive["residues"].tolist(), archive["pairs"].tolist())
+
+def build_reference_profile(list_of_sequences, name="", file=None):
+
+    # Builds the ReferenceProfile of a group of proteins, and saves it to file if one is given
+
+    profile = ReferenceProfile.build(list_of_sequences, name)
+    if file is not None:
+        profile.save(file)
+    return profile
+
+def load_reference_profile(file):
+    return ReferenceProfile.load(file)
+
+def reference_profile(group):
+
+    # A ReferenceProfile as is, the name of a file saved by ReferenceProfile.save, or a list of sequences to build it from
+
+    if isinstance(group, ReferenceProfile):
+        return group
+    if isinstance(group, str):
+        return ReferenceProfile.load(group)
+    return ReferenceProfile.build(group)
+
+def profile_distance(vector, centroid):
+
+    # Sum of the absolute differences, added up in order like the original per-residue loop so the results are identical
+
+    return sum(np.abs(vector - centroid).tolist())
+
+def classify(protein_seq, profile_1, profile_2):
+
+    # Categorizes a protein into one of two groups given by their ReferenceProfiles (or anything reference_profile accepts)
+    # The query is turned into a composition vector, and each distance is one vector subtraction
     # If the distances difference is larger than the 6, normal composition is used
     # If the distances difference is less than 6, dipeptide composition is used to try and increase the divergence
 
+    profile_1 = reference_profile(profile_1)
+    profile_2 = reference_profile(profile_2).aligned_to(profile_1)
+
     aa_composition = c.AA_Composition(protein_seq)
-    average_composition_one = c.Avg_Composition(list_of_sequences_1)
-    average_composition_two = c.Avg_Composition(list_of_sequences_2)
+    composition = np.array([aa_composition[aa] for aa in profile_1.residues])
 
-    category_1_distance = 0
-    category_2_distance = 0
+    def pair_composition():
+        aa_pair_composition = c.pair_composition(protein_seq)
+        return np.array([aa_pair_composition[pair] for pair in profile_1.pairs])
+
+    return "This protein belongs to category " + str(classify_vectors(composition, pair_composition, profile_1, profile_2))
+
+def classify_vectors(composition, pair_composition, profile_1, profile_2):
 
-    for aa in aa_composition:
-        category_1_distance += abs(aa_composition[aa] - average_composition_one[aa])
-        category_2_distance += abs(aa_composition[aa] - average_composition_two[aa])
+    # The decision of classify for a query given as vectors (in the order of the profiles' residues / pairs), returns 1 or 2
+    # Both profiles must use the same order (see ReferenceProfile.aligned_to)
+    # pair_composition can be a function returning the vector, so it is only computed when the dipeptide composition is needed
+
+    category_1_distance = profile_distance(composition, profile_1.composition)
+    category_2_distance = profile_distance(composition, profile_2.composition)
 
     if (abs((category_1_distance - category_2_distance)) > 6):
-        if category_1_distance < category_2_distance:
-            return "This protein belongs to category 1"
-        else:
-            return "This protein belongs to category 2"
+        return 1 if category_1_distance < category_2_distance else 2
+
+    if callable(pair_composition):
+        pair_composition = pair_composition()
+    category_1_distance = profile_distance(pair_composition, profile_1.pair_composition)
+    category_2_distance = profile_distance(pair_composition, profile_2.pair_composition)
+    return 1 if category_1_distance < category_2_distance else 2
+
+def feature_matrix(list_of_sequences, features="composition"):
+
+    # Feature vectors of many proteins as one matrix (one row per protein), for CentroidClassifier
+    # features is "composition" (the 21 AA_Composition values), "dipeptide" (the 441 pair_composition values) or "both" (the two side by side)
+    # The values are the rounded percentages of AA_Composition / pair_composition, computed chunk by chunk with NumPy
+    # list_of_sequences is a list / iterable of sequences or a SequenceCorpus
+
+    if features not in ("composition", "dipeptide", "both"):
+        raise ValueError("Unknown features: " + str(features))
+    if isinstance(list_of_sequences, SequenceCorpus):
+        chunks = list_of_sequences.chunks()
     else:
-        aa_pair_composition = c.pair_composition(protein_seq)
-        average_pair_composition_one = c.average_pair_composition(list_of_sequences_1)
-        average_pair_composition_two = c.average_pair_composition(list_of_sequences_2)
+        chunks = c.sequence_chunks(list_of_sequences)
+    rows = []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for chunk in chunks:
+            lengths = chunk.lengths()[:, None]
+            blocks = []
+            if features != "dipeptide":
+                blocks.append(np.round(c.corpus_counts(chunk)[:, :len(c.amino_acid_list)] / lengths * 100, 2))
+            if features != "composition":
+                # kmer_spectra_chunks may split a chunk of long sequences further, its pieces are stacked back in order
+                spectra = np.vstack([spectra for spectra, piece_lengths in c.kmer_spectra_chunks(chunk, 2, len(chunk))])
+                blocks.append(np.round(spectra * 100 / c.pair_divisors(lengths), 2))
+            rows.append(np.hstack(blocks))
+    if not rows:
+        return np.zeros((0, len(feature_names(features))))
+    return np.concatenate(rows)
+
+def feature_names(features="composition"):
+
+    # Names of the columns of feature_matrix
+
+    names = []
+    if features != "dipeptide":
+        names += list(c.amino_acid_list)
+    if features != "composition":
+        names += c.kmer_names(2)
+    return names
+
+class CentroidClassifier:
+
+    # Nearest-centroid classifier over any number of named categories
+    # centroids is a (categories, features) matrix, one average feature vector per category (see feature_matrix for the features)
+    # Queries are classified all at once: the distances of every query to every centroid are computed in one NumPy operation
+    # ... (in blocks of queries and one category at a time for L1, to bound the memory used), with one of the metrics "l1", "l2" or "cosine" (1 - cosine similarity)
+
+    def __init__(self, centroids, labels, features="composition"):
+        self.centroids = np.asarray(centroids, dtype=float)
+        self.labels = np.asarray(labels)
+        self.features = features
+        if self.centroids.shape != (len(self.labels), len(feature_names(features))):
+            raise ValueError("Expected one centroid of " + str(len(feature_names(features))) + " " + features + " features per label")
+
+    @classmethod
+    def fit(cls, groups, features="composition"):
 
-        category_1_distance = 0
-        category_2_distance = 0
+        # Builds the centroids from {category name: list of sequences (or SequenceCorpus)}
 
-        for aa in aa_pair_composition:
-            category_1_distance += abs(aa_pair_composition[aa] - average_pair_composition_one[aa])
-            category_2_distance += abs(aa_pair_composition[aa] - average_pair_composition_two[aa])
+        labels = list(groups)
+        centroids = [feature_matrix(groups[label], features).mean(axis=0) for label in labels]
+        return cls(np.array(centroids), labels, features)
 
-        if category_1_distance < category_2_distance:
-            return "This protein belongs to category 1"
+    @classmethod
+    def from_profiles(cls, profiles, features="composition"):
+
+        # Builds the centroids from ReferenceProfiles: {category name: profile}, or a list of profiles named by their name
+
+        if not isinstance(profiles, dict):
+            profiles = {profile.name: profile for profile in profiles}
+        centroids = []
+        for label in profiles:
+            profile = reference_profile(profiles[label])
+            centroid = []
+            if features != "dipeptide":
+                centroid.append(profile.composition)
+            if features != "composition":
+                centroid.append(profile.pair_composition)
+            centroids.append(np.concatenate(centroid))
+        return cls(np.array(centroids), list(profiles), features)
+
+    def save(self, file):
+        np.savez(file, centroids=self.centroids, labels=np.array([str(label) for label in self.labels]), features=np.array(self.features))
+        return file
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as archive:
+            return cls(archive["centroids"], archive["labels"], str(archive["features"]))
+
+    def queries(self, queries):
+
+        # A query matrix as is, or the feature_matrix of a list of sequences / SequenceCorpus
+
+        if isinstance(queries, np.ndarray):
+            return queries.astype(float, copy=False)
+        return feature_matrix(queries, self.features)
+
+    def distances(self, queries, metric="l1", block_size=4096):
+
+        # (queries, categories) matrix of the distances of every query to every centroid
+
+        queries = self.queries(queries)
+        if metric == "l1":
+            # One category at a time, so the temporary is a (block_size, features) block whatever the number of categories
+            distances = np.zeros((len(queries), len(self.labels)))
+            for start in range(0, len(queries), block_size):
+                block = queries[start:start + block_size]
+                for category, centroid in enumerate(self.centroids):
+                    distances[start:start + block_size, category] = np.abs(block - centroid).sum(axis=1)
+            return distances
+        if metric == "l2":
+            squared = (queries ** 2).sum(axis=1)[:, None] + (self.centroids ** 2).sum(axis=1)[None, :] - 2 * queries @ self.centroids.T
+            return np.sqrt(np.maximum(squared, 0))
+        if metric == "cosine":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                norms = np.linalg.norm(queries, axis=1)[:, None] * np.linalg.norm(self.centroids, axis=1)[None, :]
+                return 1 - (queries @ self.centroids.T) / norms
+        raise ValueError("Unknown metric: " + str(metric))
+
+    def predict(self, queries, metric="l1"):
+
+        # Returns (labels, margins): the label of the nearest centroid of every query,
+        # ... and how much farther the second nearest centroid is (NaN with a single category), a small margin meaning an uncertain call
+
+        distances = self.distances(queries, metric)
+        nearest = np.argmin(distances, axis=1)
+        if len(self.labels) > 1:
+            closest = np.partition(distances, 1, axis=1)[:, :2]
+            margins = closest[:, 1] - closest[:, 0]
         else:
-            return "This protein belongs to category 2"
+            margins = np.full(len(distances), np.nan)
+        return self.labels[nearest], margins
+
+def categorize_by_distance(protein_seq, list_of_sequences_1, list_of_sequences_2):
+
+    # This main function serves to categorize a protein into one of two groups
+    # ... by finding the difference between the composition of each amino acid in protein_seq and the average composition of the same amino acid in list_of_sequences_1 and list_of_sequences_2
+    # Those differences are then summed, once for each group
+    # If the distances difference is larger than the 6, normal composition is used
+    # If the distances difference is less than 6, dipeptide composition is used to try and increase the divergence
+    # Both groups can also be given as ReferenceProfiles (or .npz files saved by ReferenceProfile.save),
+    # ... so categorizing many proteins against the same two groups does not recompute their average compositions (see classify)
+
+    return classify(protein_seq, list_of_sequences_1, list_of_sequences_2)
 
 def folded_or_unfolded(protein_seq):
+
+    # Prints whether a protein is natively folded or unfolded (see folding_state, which returns the answer instead)
+
+    state = folding_state(protein_seq)
+    if state == "unfolded":
+        return print("Protein is natively unfolded")
+    elif state == "folded":
+        return print("Protein is natively folded")
+    else:
+        return print('Inconclusive')
+
+def folding_state(protein_seq):
+
+    # Returns "folded", "unfolded" or "inconclusive"
     # Two versions of code are provided below, both are inspired by the following paper: https://doi.org/10.1002/1097-0134(20001115)41:3<415::AID-PROT130>3.0.CO;2-7
     # We coded the first version based on the explanation provided by the paper; however, its results are inaccurate.
     # ... This may be because we misinterpreted the calculation steps described in the paper or because the paper may have left out some details.
@@ -75,8 +328,62 @@ def folded_or_unfolded(protein_seq):
 
     # Compares the mean hydrophobicity value calculated with the experimentally-derived hydrophobicity cutoff values of natively folded and unfolded proteins
     if (mean_hydrophobicity >= 0.34 and mean_hydrophobicity <= 0.44):
-        return print("Protein is natively unfolded")
+        return "unfolded"
     elif (mean_hydrophobicity >= 0.45 and mean_hydrophobicity <= 0.51):
-        return print("Protein is natively folded")
+        return "folded"
     else:
-        return print('Inconclusive')
+        return "inconclusive"
+
+def uversky_boundary(mean_net_charge):
+
+    # Mean normalized hydropathy below which a protein of the given mean net charge is natively unfolded (Uversky et al., 2000):
+    # <H>b = (<R> + 1.151) / 2.785
+
+    return (mean_net_charge + 1.151) / 2.785
+
+def uversky_table(chunk, ambiguous="average"):
+
+    # Charge-hydropathy screen of every sequence of a SequenceCorpus chunk, as a DataFrame with one row per protein:
+    # id, length, mean_hydropathy (mean Kyte-Doolittle value rescaled from [-4.5, 4.5] to [0, 1]),
+    # mean_net_charge (|K + R - D - E| / length), boundary_hydropathy (uversky_boundary), distance (mean_hydropathy - boundary)
+    # ... and state: "unfolded" below the boundary, "folded" otherwise
+    # Both means come from vectorized lookups over the packed residues; ambiguous is the policy of characterization.residue_value_sums
+    # A protein with a residue the policy leaves without a hydropathy (e.g. O, or X with "error") is "inconclusive" instead of aborting the screen,
+    # ... as is an empty one
+    # This is the published charge-hydropathy boundary, a different model from folding_state / folded_or_unfolded:
+    # ... the two can label the same protein differently
+
+    ids = chunk.ids if chunk.ids is not None else np.arange(len(chunk))
+    totals, counts = c.residue_value_sums(chunk, c.hydrophobicity_tables, ambiguous, "nan")
+    residue_counts = c.corpus_counts(chunk)
+    lengths = chunk.lengths()
+    charge = residue_counts[:, [c.amino_acid_list.index(aa) for aa in "KR"]].sum(axis=1) - \
+             residue_counts[:, [c.amino_acid_list.index(aa) for aa in "DE"]].sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_hydropathy = (totals / counts + 4.5) / 9
+        mean_net_charge = np.abs(charge) / lengths
+    boundary = uversky_boundary(mean_net_charge)
+    distance = mean_hydropathy - boundary
+    return pd.DataFrame({"id": np.asarray(ids), "length": lengths, "mean_hydropathy": mean_hydropathy, "mean_net_charge": mean_net_charge,
+                         "boundary_hydropathy": boundary, "distance": distance,
+                         "state": np.where(np.isnan(distance), "inconclusive", np.where(distance < 0, "unfolded", "folded"))})
+
+def uversky_screen_chunks(source, chunk_size=10000, workers=1, ambiguous="average"):
+
+    # Generator of the uversky_table of consecutive chunks of a dataset, in input order, so a whole proteome streams through in bounded memory
+    # source is anything characterization.source_chunks reads: a FASTA file name, a SequenceCorpus, an iterable of sequences or records
+    # With workers > 1 (0 = one per CPU), the chunks are screened in a process pool
+
+    return parallel.ordered_map(partial(uversky_table, ambiguous=ambiguous), c.source_chunks(source, chunk_size), workers)
+
+def uversky_screen(source, chunk_size=10000, workers=1, ambiguous="average"):
+
+    # Charge-hydropathy (Uversky) folded / unfolded screen of a whole dataset, as one labelled DataFrame (see uversky_table)
+    # Unlike folded_or_unfolded, which prints its answer for one protein, this returns a table that can be filtered,
+    # ... e.g. screen[screen.state == "unfolded"] for the natively unfolded candidates of a proteome
+    # It uses the Uversky boundary, not the model of folded_or_unfolded, so their labels can disagree for a protein
+
+    tables = list(uversky_screen_chunks(source, chunk_size, workers, ambiguous))
+    if not tables:
+        return uversky_table(SequenceCorpus.from_sequences([]), ambiguous)
+    return pd.concat(tables, ignore_index=True)
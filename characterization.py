@@ -1,5 +1,177 @@
 import numpy as np
+from collections import namedtuple
+from functools import partial, lru_cache
+import pandas as pd
 import matplotlib.pyplot as plt
+import fetch
+import parallel
+import aggregates
+import feature_cache
+from corpus import SequenceCorpus
+
+# The 21 residues reported by the occurence / composition functions, in the order they are reported
+amino_acid_list = "AGPVLIMCFYWHKRQNEDSTU"
+
+# Amino acids molecular weight (Dalton) source: https://worldwide.promega.com/resources/tools/amino-acid-chart-amino-acid-structure/#:~:text=The%20average%20molecular%20weight%20of,(kDa)%20is%201%2C000%20daltons
+aa_mass_dic = {"A": 89, "G": 75, "P": 115, "V": 117, "L": 131, "I": 131,
+               "M": 149, "C": 121, "F": 165, "Y": 181, "W": 204, "H": 155,
+               "K": 146, "R": 174, "Q": 146, "N": 132, "E": 147, "D": 133,
+               "S": 105, "T": 119, "U": 167}
+
+# Kyte-Doolittle hydrophobicity scale
+aa_hydrophobicity = {'I': 4.50, 'V': 4.20, 'L': 3.80, 'F': 2.80, 'C': 2.50, 'M': 1.90, 'A': 1.80, 'G': -0.40, 'T': -0.70, 'S': -0.80,
+                     'W': -0.90,'Y': -1.30, 'P': -1.60, 'H': -3.20, 'E': -3.50, 'N': -3.50, 'Q': -3.50, 'D': -3.50, 'K': -3.90, 'R': -4.50, 'U': 2.50}
+
+# Ambiguous residue codes and the residues they stand for (X is any of the 20 standard amino acids)
+ambiguous_residues = {"B": "DN", "Z": "EQ", "J": "IL", "X": "ACDEFGHIKLMNPQRSTVWY"}
+
+# Byte-indexed version of a residue --> value dictionary (256 entries, indexed by ASCII code), for np.take over whole sequences
+# values holds the values as fixed point integers (value * scale), known tells which bytes have a value
+LookupTable = namedtuple("LookupTable", ["values", "known", "scale"])
+
+def lookup_tables(values, scale):
+
+    # Returns (strict, averaged) LookupTables of a residue --> value dictionary
+    # strict only knows the residues of values,
+    # ... averaged also gives every ambiguous residue the mean value of the residues it stands for (B = mean of D and N, etc.)
+    # scale must make every value and every mean an integer, so the sums are exact whatever their order (e.g. 20 for integers, as X averages 20 values)
+
+    strict = np.zeros(256, dtype=np.int32)
+    known = np.zeros(256, dtype=bool)
+    for aa, value in values.items():
+        strict[ord(aa)] = int(round(value * scale))
+        known[ord(aa)] = True
+    averaged = strict.copy()
+    averaged_known = known.copy()
+    for aa, residues in ambiguous_residues.items():
+        averaged[ord(aa)] = int(round(np.mean([values[residue] for residue in residues]) * scale))
+        averaged_known[ord(aa)] = True
+    return LookupTable(strict, known, scale), LookupTable(averaged, averaged_known, scale)
+
+mass_tables = lookup_tables(aa_mass_dic, 20)
+hydrophobicity_tables = lookup_tables(aa_hydrophobicity, 200)
+
+# Fixed point scales of the dataset averages: the per-protein values are exact multiples of 1 / scale (charges are multiples of 0.5,
+# ... hydrophobicity and compositions are rounded to 2 decimals), except the isoelectric points, kept to 1e-6 pH
+dataset_sum_scales = {"net_charge_pH7": 2, "isoelectric_point_scan": 10 ** 6, "hydrophobicity": 100, "composition": 100}
+
+def fixed_point_sum(values, scale):
+
+    # Sum of per-protein values as an integer number of 1 / scale, so it is exact and does not depend on the order of the values
+    # (a float sum of 2-decimal values drifts, and the average then lands on the other side of a rounding boundary)
+    # The average_* functions and export add the same integers, so they report the same averages
+
+    if isinstance(values, (int, float)):
+        return int(round(values * scale))
+    return int(np.rint(np.asarray(values, dtype=float) * scale).astype(np.int64).sum())
+
+def fixed_point_average(total, scale, count, digits):
+    return round(total / scale / count, digits)
+
+# pKa values used by side_chain_charge: ionizable residue --> (pKa, charge when ionized)
+side_chain_pKa = {"C": (8.4, -1), "Y": (10.5, -1), "D": (4, -1), "E": (4, -1), "K": (10.5, 1), "R": (12.5, 1), "H": (6, 1)}
+side_chain_pKa_values = np.array([side_chain_pKa[aa][0] for aa in side_chain_pKa])
+side_chain_signs = np.array([side_chain_pKa[aa][1] for aa in side_chain_pKa])
+
+# pKa values used by adjustTotal: last residue --> pKa of the terminal group that becomes negatively charged above it
+terminal_pKa = {"G": 9.6, "L": 9.6, "I": 9.6, "D": 9.6, "V": 9.6, "A": 9.7, "E": 9.7, "M": 9.2, "S": 9.2, "H": 9.2,
+                "P": 10.6, "F": 9.1, "Q": 9.1, "T": 9.1, "Y": 9.1, "W": 9.4, "N": 8.8, "C": 8.2, "K": 9, "R": 9}
+terminal_pKa_table = np.full(256, np.nan)
+terminal_pKa_table[[ord(aa) for aa in terminal_pKa]] = list(terminal_pKa.values())
+
+# total_charge adds a group that is positively charged below this pH
+terminal_positive_pKa = 2
+
+# Residue classes used by the num_* / percent_* / average_* functions
+negative_residues = "DE"
+positive_residues = "RHK"
+hydrophobic_residues = "GAVLIPFMW"
+hydrophilic_residues = "HEDNQKR"
+aliphatic_residues = "GAVLIP"
+aromatic_residues = "FYW"
+
+@lru_cache(maxsize=1024)
+def residue_histogram(protein_seq):
+
+    # Counts every character of a protein sequence in one pass: np.bincount over the byte view of the string (256 bins, indexed by ASCII code)
+    # Every count / percent / composition function reads from this histogram, and the last 1024 histograms are cached,
+    # ... so characterizing a sequence walks it once instead of once per counted residue
+    # It is a plain lru_cache keyed on the string, not the shared feature cache: a histogram is cheaper to compute than a feature cache key
+    # Non-ASCII characters are counted as "?", they are unknown residues anyway
+    # The returned array is read-only because it is shared through the cache
+
+    histogram = np.bincount(np.frombuffer(protein_seq.encode("ascii", errors="replace"), dtype=np.uint8), minlength=256)
+    histogram.flags.writeable = False
+    return histogram
+
+def count_residues(protein_seq, residues):
+
+    # Total number of residues of protein_seq that are in residues (a string such as "DE"), read from the histogram
+
+    histogram = residue_histogram(protein_seq)
+    return int(sum(histogram[ord(aa)] for aa in residues))
+
+def num_unknown(protein_seq):
+
+    # Number of characters of protein_seq that are not one of the 21 residues of amino_acid_list (X, B, Z, etc.)
+
+    return len(protein_seq) - count_residues(protein_seq, amino_acid_list)
+
+def corpus_counts(corpus):
+
+    # Counts of every residue of amino_acid_list in every sequence of a SequenceCorpus, computed with NumPy in one pass
+    # One row per sequence, the last column counts any other character
+
+    return corpus.residue_counts(amino_acid_list)
+
+def corpus_class_counts(corpus, residues):
+
+    # Number of residues belonging to a class (e.g. "DE" for negatively charged) in every sequence of a SequenceCorpus
+
+    columns = [amino_acid_list.index(aa) for aa in residues]
+    return corpus_counts(corpus)[:, columns].sum(axis=1)
+
+def check_corpus_residues(corpus, table):
+
+    # Raises a KeyError for the first residue of the corpus that has no entry in table, like the per-sequence functions do
+
+    for code in np.unique(np.asarray(corpus.residues)):
+        if chr(code) not in table:
+            raise KeyError(chr(code))
+
+def average_class_count(list_of_sequences, residues, count_function):
+
+    # Average number of residues of a class per sequence
+    # A SequenceCorpus is counted with NumPy, any other list / iterable of sequences uses count_function on every sequence
+    # The sequences are counted while they are read, so a generator (e.g. fetch.read_fasta) works too
+
+    if isinstance(list_of_sequences, SequenceCorpus):
+        sum = int(corpus_class_counts(list_of_sequences, residues).sum())
+        count = len(list_of_sequences)
+    else:
+        sum = 0
+        count = 0
+        for seq in list_of_sequences:
+            sum += count_function(seq)
+            count += 1
+
+    return round(sum / count,0)
+
+def average_class_percent(list_of_sequences, residues, count_function):
+
+    # Same value as average_num_* / average_protein_length, from a single pass over the sequences
+
+    if isinstance(list_of_sequences, SequenceCorpus):
+        return round(average_class_count(list_of_sequences, residues, count_function) / average_protein_length(list_of_sequences),2)
+
+    sum = 0
+    sum_length = 0
+    count = 0
+    for seq in list_of_sequences:
+        sum += count_function(seq)
+        sum_length += len(seq)
+        count += 1
+    return round(round(sum / count,0) / round(sum_length / count,0),2)
 
 def side_chain_charge(aa, pH=7):
 
@@ -69,12 +241,12 @@ def adjustTotal(num, protein_seq, pH):
             num = num - 1
         elif pH == 9.6:
             num = num - 0.5
-    elif protein_seq[-1] == "A" or protein_seq == "E":
+    elif protein_seq[-1] == "A" or protein_seq[-1] == "E":
         if pH > 9.7:
             num = num - 1
         elif pH == 9.7:
             num = num - 0.5
-    elif protein_seq[-1] == "M" or protein_seq == "S" or protein_seq == "H":
+    elif protein_seq[-1] == "M" or protein_seq[-1] == "S" or protein_seq[-1] == "H":
         if pH > 9.2:
             num = num - 1
         elif pH == 9.2:
@@ -124,7 +296,7 @@ def pair_combinations():
             combinations[combination] = 0
     return combinations
 
-pair_combs = pair_combinations() # This is the variable that stores the pair combinations
+pair_combs = pair_combinations() # This is the variable that stores the pair combinations (it is never modified, pair_occurence returns new dictionaries)
 
 def count_duplicate_pair(protein_seq, duplicate):
 
@@ -142,50 +314,141 @@ def count_duplicate_pair(protein_seq, duplicate):
             sum += 1
     return sum
 
+# Residue order of the k-mer spectra (the same order as pair_combinations), and a lookup from ASCII code to position (21 = unknown)
+kmer_alphabet = "ACDEFGHIKLMNPQRSTVWYU"
+kmer_codes = np.full(256, len(kmer_alphabet), dtype=np.int64)
+kmer_codes[np.frombuffer(kmer_alphabet.encode("ascii"), dtype=np.uint8)] = np.arange(len(kmer_alphabet))
+
+def kmer_names(k):
+
+    # All 21^k k-mers in the order of the spectrum arrays, e.g. "AA", "AC", ..., "UU" for k = 2
+
+    names = [""]
+    for i in range(k):
+        names = [name + aa for name in names for aa in kmer_alphabet]
+    return names
+
+def kmer_window_index(codes, k):
+
+    # Encodes every window of k residues as one integer in base 21 (the strided encoding: index = index * 21 + next residue)
+    # Returns the indices and a mask of the windows that contain no unknown residue
+
+    n = len(codes) - k + 1
+    index = np.zeros(max(n, 0), dtype=np.int64)
+    valid = np.ones(max(n, 0), dtype=bool)
+    for j in range(k):
+        window = codes[j:j + n]
+        index = index * len(kmer_alphabet) + window
+        valid &= window < len(kmer_alphabet)
+    return index, valid
+
+def kmer_spectrum(protein_seq, k=2):
+
+    # Overlapping counts of every k-mer (k = 1, 2 or 3) of a protein sequence, as a dense array of 21^k counts (see kmer_names)
+    # It is one integer encoding of the windows and one bincount, whatever k is
+    # Overlapping means "AAA" has an "AA" count of 2, like count_duplicate_pair
+    # Windows with a residue outside kmer_alphabet are not counted
+
+    codes = kmer_codes[np.frombuffer(protein_seq.encode("ascii", errors="replace"), dtype=np.uint8)]
+    index, valid = kmer_window_index(codes, k)
+    return np.bincount(index[valid], minlength=len(kmer_alphabet) ** k)
+
+def kmer_occurence(protein_seq, k=2):
+
+    # The same counts as kmer_spectrum, as a dictionary {k-mer: count}
+
+    return dict(zip(kmer_names(k), kmer_spectrum(protein_seq, k).tolist()))
+
+def kmer_spectra(list_of_sequences, k=2):
+
+    # Batch mode of kmer_spectrum: one row of 21^k counts per sequence, for a SequenceCorpus or any list of sequences
+    # The whole (chunk of the) corpus is encoded at once; windows that would cross from one sequence to the next are dropped
+    # The result holds n * 21^k integers, so use kmer_spectra_chunks for very large datasets
+
+    return np.concatenate([spectra for spectra, lengths in kmer_spectra_chunks(list_of_sequences, k)] or [np.zeros((0, len(kmer_alphabet) ** k), dtype=np.int64)])
+
+def kmer_spectra_chunks(list_of_sequences, k=2, chunk_size=1024):
+
+    # Generator of (spectra, lengths) for consecutive chunks of a dataset, so the memory used stays bounded
+    # Every chunk holds at most chunk_size sequences (and a SequenceCorpus at most 2^22 residues), so a dense block has at most chunk_size * 21^k counts
+
+    if isinstance(list_of_sequences, SequenceCorpus):
+        chunks = (part for chunk in list_of_sequences.chunks()
+                  for part in (chunk.slice(start, min(start + chunk_size, len(chunk))) for start in range(0, len(chunk), chunk_size)))
+    else:
+        chunks = sequence_chunks(list_of_sequences, chunk_size)
+    size = len(kmer_alphabet) ** k
+    for chunk in chunks:
+        codes = kmer_codes[np.asarray(chunk.residues)]
+        index, valid = kmer_window_index(codes, k)
+        owner = chunk.sequence_index()
+        if len(index):
+            valid &= owner[:len(index)] == owner[k - 1:]
+        flat = owner[:len(index)][valid] * size + index[valid]
+        spectra = np.bincount(flat, minlength=len(chunk) * size).reshape(len(chunk), size)
+        yield spectra, chunk.lengths()
+
+def pair_divisors(lengths):
+
+    # (length - 1) of every sequence, the number of its pairs; sequences shorter than 2 have no pair, so they get 1 and a composition of 0
+
+    return np.maximum(np.asarray(lengths) - 1, 1)
+
+def sequence_chunks(list_of_sequences, chunk_size=1024):
+
+    # Packs any iterable of sequences into consecutive SequenceCorpus chunks of chunk_size sequences
+
+    chunk = []
+    for seq in list_of_sequences:
+        chunk.append(seq)
+        if len(chunk) == chunk_size:
+            yield SequenceCorpus.from_sequences(chunk)
+            chunk = []
+    if chunk:
+        yield SequenceCorpus.from_sequences(chunk)
+
 def pair_occurence(protein_seq):
 
-    # This function fills the initialized dictionary above with the real counts of pairs
-    # It handles the case if the pair is duplicate using the function above
-    # If the pair is not duplicate, it is counted normally using built-in ".count"
+    # This function gives the real counts of pairs, as a new dictionary every time (the keys of pair_combinations)
+    # The counts are overlapping, so duplicate pairs are handled like count_duplicate_pair does
+    # They come from the dipeptide spectrum, which is a single pass over the sequence
 
-    pair_occurence = pair_combs
-    for pair in pair_occurence:
-        if pair[0] != pair[1]:
-            pair_occurence[pair] = protein_seq.count(pair)
-        else:
-            pair_occurence[pair] = count_duplicate_pair(protein_seq, pair)
-    return pair_occurence
+    return kmer_occurence(protein_seq, 2)
 
 def pair_composition(protein_seq):
 
     # This function is to normalize the above function by the (length of the protein sequence - 1) to find composition
     # Therefore, occurrence is a count, but composition is a percentage
     # It's (length - 1) and not just (length) based on literature, I don't know really why tho.
+    # A sequence shorter than 2 residues has no pair, its composition is 0 for every pair
 
     composition = {}
-    for pair in pair_occurence(protein_seq):
-        composition[pair] = round((pair_occurence(protein_seq)[pair] * 100) / (len(protein_seq) - 1), 2)
+    occurence = pair_occurence(protein_seq)
+    divisor = max(len(protein_seq) - 1, 1)
+    for pair in occurence:
+        composition[pair] = round((occurence[pair] * 100) / divisor, 2)
     return composition
 
+@feature_cache.cached("average_pair_composition")
 def average_pair_composition(list_of_sequences):
 
-    # This function makes use of the function above it to calculate pair composition for a list of proteins, rather than an individual protein
-    # It loops over every protein and saves its composition dictionary
-    # In the average dictionary, the pair composition, for each protein sequence, is incremented
+    # This function calculates the pair composition for a list of proteins (or a SequenceCorpus), rather than an individual protein
+    # The rounded pair compositions of every protein are summed, chunk by chunk, from the batch dipeptide spectra
+    # ... then the average of each pair is found
 
-    average_pair_composition = pair_combs
-    # This is to increment the pairs
-    for sequence in list_of_sequences:
-        composition = pair_composition(sequence)
-        for pair in composition:
-            average_pair_composition[pair] += round(composition[pair], 2)
+    total = np.zeros(len(kmer_alphabet) ** 2)
+    count = 0
+    for spectra, lengths in kmer_spectra_chunks(list_of_sequences, 2):
+        total += np.round((spectra * 100) / pair_divisors(lengths)[:, None], 2).sum(axis=0)
+        count += len(lengths)
 
-    # This is to find the average value of each pair
-    for pair in average_pair_composition:
-        average_pair_composition[pair] = round(average_pair_composition[pair] / len(list_of_sequences),2)
+    average_pair_composition = {}
+    for pair, value in zip(kmer_names(2), total.tolist()):
+        average_pair_composition[pair] = round(value / count, 2)
 
     return average_pair_composition
 
+@feature_cache.cached("isoelectric_point")
 def isoelectric_point(protein_seq):
 
     # This function uses a brute-force algorithm to locate the specific pH at which the total charge is 0
@@ -197,8 +460,11 @@ def isoelectric_point(protein_seq):
     zero_charge_list = []
     counter = 0
     # it tests all pHs from 2.0 until 12.6, with a step of 0.1, until it reaches a total charge of 0
+    # The charge is computed once per pH, from the residue counts (see total_charge)
+    # For a precise (continuous) isoelectric point, use isoelectric_point_hh instead
     for ph in np.arange(2.0, 12.6, 0.1):
-        if total_charge(protein_seq, ph) == 0:
+        charge = total_charge(protein_seq, ph)
+        if charge == 0:
             # Upon finding at least one pH that makes the total charge 0, I increment a counter which is initialized as 0
             counter += 1
             # Since many pHs might make the charge 0, I add all the pHs that make the charge 0 in a list called zero_charge_list
@@ -206,14 +472,14 @@ def isoelectric_point(protein_seq):
         # To handle any errors, I assume no pH will make the total charge 0.
         # So I check if the total charge is > than 0 but < min_positive, in which case the min_positive is updated
         # ... to update the pH at which the charge is the most small positive charge
-        elif total_charge(protein_seq, ph) > 0:
-            if total_charge(protein_seq, ph) < min_positive:
-                min_positive = total_charge(protein_seq, ph)
+        elif charge > 0:
+            if charge < min_positive:
+                min_positive = charge
                 pH_min_positive = ph
         # By the same token for cases where the total charge will be negative...
         else:
-            if total_charge(protein_seq, ph) > min_negative:
-                min_negative = total_charge(protein_seq, ph)
+            if charge > min_negative:
+                min_negative = charge
                 pH_min_negative = ph
 
     # Finally, if the counter (initialized as 0) remains 0, meaning no pH made the total charge 0
@@ -229,23 +495,32 @@ def average_isoelectric_point(list_of_sequences):
 
     # Utilizes the above function to calculate average isoelectric point for a list of sequences
 
+    scale = dataset_sum_scales["isoelectric_point_scan"]
     summ = 0
+    count = 0
     for seq in list_of_sequences:
         # Gets an average of the isoelectric points, since the above functions outputs at least two pHs, if not more
-        iso = sum(isoelectric_point(seq)) / len(isoelectric_point(seq))
-        # This average is added to a counter, initialized as 0
-        summ += iso
+        points = isoelectric_point(seq)
+        iso = sum(points) / len(points)
+        # This average is added to a counter, initialized as 0 (in fixed point, like export, see fixed_point_sum)
+        summ += fixed_point_sum(iso, scale)
+        count += 1
 
     # The average of the entire list is then calculated
-    return round(summ / len(list_of_sequences), 1)
+    return fixed_point_average(summ, scale, count, 1)
 
 def total_charge(protein_seq, pH=7):
 
     # Utilizes side_chain_charge(aa, pH=7) and adjustTotal(num, protein_seq, pH) to calculate the total charge
+    # Only the ionizable residues have a side chain charge, so each of them is counted once (from the residue histogram)
+    # ... and its charge is multiplied by its count, instead of looping over every residue
 
+    histogram = residue_histogram(protein_seq)
     total = 0
-    for aa in protein_seq:
-        total += side_chain_charge(aa, pH)
+    for aa in side_chain_pKa:
+        count = int(histogram[ord(aa)])
+        if count:
+            total += count * side_chain_charge(aa, pH)
     if pH < 2:
         total = total + 1
     elif pH == 2:
@@ -256,129 +531,226 @@ def total_charge(protein_seq, pH=7):
 
 def average_total_charge(list_of_sequences, pH = 7):
 
-    # Utilizes the above function to calculate average total charge for a list of protein sequences
+    # Calculates the average total charge for a list of protein sequences (or a SequenceCorpus)
+    # The charges are the ones of total_charge, but all computed at once by charge_matrix
 
-    sum = 0
-    for seq in list_of_sequences:
-        sum += total_charge(seq, pH)
+    charges = charge_matrix(list_of_sequences, [pH], "step")
+
+    return round(float(charges.sum()) / len(charges), 1)
+
+def ionizable_counts(list_of_sequences):
+
+    # Counts of the ionizable residues (in the order of side_chain_pKa) of every sequence, and the terminal pKa of every sequence
+    # Works on a SequenceCorpus or any list of sequences, and returns NumPy arrays: (n, 7) counts and n terminal pKas
+    # The terminal pKa is NaN when the last residue has no entry in terminal_pKa (or the sequence is empty)
 
-    return round(sum / len(list_of_sequences), 1)
+    counts = []
+    terminals = []
+    chunks = list_of_sequences.chunks() if isinstance(list_of_sequences, SequenceCorpus) else sequence_chunks(list_of_sequences)
+    for chunk in chunks:
+        counts.append(chunk.residue_counts("".join(side_chain_pKa))[:, :len(side_chain_pKa)])
+        terminals.append(terminal_pKas(chunk))
+    if not counts:
+        return np.zeros((0, len(side_chain_pKa)), dtype=np.int64), np.zeros(0)
+    return np.concatenate(counts), np.concatenate(terminals)
+
+def terminal_pKas(corpus):
+
+    # The terminal pKa of every sequence of a SequenceCorpus, read from the last residue of each sequence (NaN if none)
+
+    last = np.asarray(corpus.residues)[np.maximum(corpus.offsets[1:] - 1, 0)]
+    return np.where(corpus.lengths() > 0, terminal_pKa_table[last], np.nan)
+
+def ionized_fraction(pH, pKa, model="continuous"):
+
+    # Fraction of an acidic (negatively charged) group that is ionized at pH; for a basic group it is 1 minus this fraction
+    # "continuous" is Henderson-Hasselbalch: 1 / (1 + 10^(pKa - pH))
+    # "step" is the model of side_chain_charge / adjustTotal: 0 below the pKa, 0.5 at the pKa, 1 above
+
+    if model == "continuous":
+        return 1 / (1 + 10 ** (pKa - pH))
+    elif model == "step":
+        return np.where(pH > pKa, 1.0, np.where(pH == pKa, 0.5, 0.0))
+    else:
+        raise ValueError("Unknown charge model: " + str(model))
+
+def group_charges(pH, model="continuous"):
+
+    # Charge of one residue of each kind of side_chain_pKa (shape pH.shape + (7,)) and of the positive group of total_charge (shape pH.shape)
+
+    pH = np.asarray(pH, dtype=float)
+    acid = ionized_fraction(pH[..., None], side_chain_pKa_values, model)
+    charges = np.where(side_chain_signs > 0, 1 - acid, -acid)
+    return charges, 1 - ionized_fraction(pH, terminal_positive_pKa, model)
+
+def terminal_charge(terminals, pH, model="continuous"):
+
+    # Charge of the terminal group of adjustTotal, 0 for sequences without a terminal pKa (NaN)
+
+    return np.nan_to_num(-ionized_fraction(pH, terminals, model), nan=0.0)
+
+def charge_from_counts(counts, terminals, pH, model="continuous"):
+
+    # Net charge of every sequence from the arrays given by ionizable_counts, at a pH that is either shared or one per sequence
+    # Every group contributes its charge times its ionized fraction, with the same pKas as total_charge:
+    # ... the side chains of side_chain_pKa, a positive group of pKa 2 and a negative terminal group of terminal_pKa
+
+    charges, positive = group_charges(pH, model)
+    return (counts * charges).sum(axis=-1) + positive + terminal_charge(terminals, np.asarray(pH, dtype=float), model)
+
+def charge_matrix(list_of_sequences, pH_values, model="step"):
+
+    # Net charge of every sequence (a SequenceCorpus or any list of sequences) at every pH of pH_values
+    # Returns an (n_sequences x n_pH) array, e.g. one titration curve per row
+    # The residue counts are taken once; the charge of each kind of group is computed once per pH,
+    # ... so the side chains of the whole dataset are one matrix product (counts x charges), plus the terminal groups by broadcasting
+    # model "step" gives exactly total_charge, "continuous" gives continuous_charge
+
+    counts, terminals = ionizable_counts(list_of_sequences)
+    return charge_matrix_from_counts(counts, terminals, pH_values, model)
+
+def charge_matrix_from_counts(counts, terminals, pH_values, model="step"):
+
+    # charge_matrix for the arrays given by ionizable_counts
+
+    pH_values = np.atleast_1d(np.asarray(pH_values, dtype=float))
+    charges, positive = group_charges(pH_values, model)
+    return counts @ charges.T + positive[None, :] + terminal_charge(terminals[:, None], pH_values[None, :], model)
+
+def continuous_charge(protein_seq, pH=7):
+
+    # Net charge of a protein at any pH with the continuous (Henderson-Hasselbalch) model, instead of the step model of total_charge
+    # At every pKa the two models agree (half charged group); away from the pKas the continuous model changes smoothly
+
+    counts, terminals = ionizable_counts([protein_seq])
+    return float(charge_from_counts(counts, terminals, pH)[0])
+
+def batch_isoelectric_point(list_of_sequences, precision=0.001):
+
+    # Isoelectric points of a whole dataset (a SequenceCorpus or any list of sequences), as a NumPy array
+    # The residue counts are taken once, then all the sequences are bisected together on the continuous charge:
+    # ... the charge always decreases with pH, so the pH range [0, 14] is halved until it is narrower than precision
+    # That is about 14 vectorized charge evaluations for 0.001 pH, whatever the number of sequences
+
+    counts, terminals = ionizable_counts(list_of_sequences)
+    return isoelectric_point_from_counts(counts, terminals, precision)
+
+def isoelectric_point_from_counts(counts, terminals, precision=0.001):
+
+    # batch_isoelectric_point for the arrays given by ionizable_counts
+
+    low = np.zeros(len(counts))
+    high = np.full(len(counts), 14.0)
+    while (high - low).max(initial=0) >= precision:
+        middle = (low + high) / 2
+        positive = charge_from_counts(counts, terminals, middle) > 0
+        low = np.where(positive, middle, low)
+        high = np.where(positive, high, middle)
+    return (low + high) / 2
+
+def isoelectric_point_hh(protein_seq, precision=0.001):
+
+    # Isoelectric point of one protein with the continuous charge model, to the given pH precision (see batch_isoelectric_point)
+    # Unlike isoelectric_point, this gives a single pH
+
+    return float(batch_isoelectric_point([protein_seq], precision)[0])
 
 def num_negative_charge(protein_seq):
-    return protein_seq.count("D") + protein_seq.count("E")
+    return count_residues(protein_seq, negative_residues)
 
 def average_num_negative_charge(list_of_sequences):
-    sum = 0
-    for seq in list_of_sequences:
-        sum += num_negative_charge(seq)
-
-    return round(sum / len(list_of_sequences),0)
+    return average_class_count(list_of_sequences, negative_residues, num_negative_charge)
 
 def num_positive_charge(protein_seq):
-    return protein_seq.count("R") + protein_seq.count("H") + protein_seq.count("K")
+    return count_residues(protein_seq, positive_residues)
 
 def average_num_positive_charge(list_of_sequences):
-    sum = 0
-    for seq in list_of_sequences:
-        sum += num_positive_charge(seq)
-
-    return round(sum / len(list_of_sequences),0)
+    return average_class_count(list_of_sequences, positive_residues, num_positive_charge)
 
 def num_hydrophobic(protein_seq):
-    return protein_seq.count("G") + protein_seq.count("A") + protein_seq.count("V") + protein_seq.count("L") + protein_seq.count("I") + protein_seq.count("P") + protein_seq.count("F") + protein_seq.count("M") + protein_seq.count("W")
+    return count_residues(protein_seq, hydrophobic_residues)
 
 def average_num_hydrophobic(list_of_sequences):
-    sum = 0
-    for seq in list_of_sequences:
-        sum += num_hydrophobic(seq)
-
-    return round(sum / len(list_of_sequences),0)
+    return average_class_count(list_of_sequences, hydrophobic_residues, num_hydrophobic)
 
 def num_hydrophilic(protein_seq):
-    return protein_seq.count("H") + protein_seq.count("E") + protein_seq.count("D") + protein_seq.count("N") + protein_seq.count("Q") + protein_seq.count("K") + protein_seq.count("R")
+    return count_residues(protein_seq, hydrophilic_residues)
 
 def average_num_hydrophilic(list_of_sequences):
-    sum = 0
-    for seq in list_of_sequences:
-        sum += num_hydrophilic(seq)
-
-    return round(sum / len(list_of_sequences),0)
+    return average_class_count(list_of_sequences, hydrophilic_residues, num_hydrophilic)
 
 def num_aliphatic(protein_seq):
-    return protein_seq.count("G") + protein_seq.count("A") + protein_seq.count("V") + protein_seq.count("L") + protein_seq.count("I") + protein_seq.count("P")
+    return count_residues(protein_seq, aliphatic_residues)
 
 def average_num_aliphatic(list_of_sequences):
-    sum = 0
-    for seq in list_of_sequences:
-        sum += num_aliphatic(seq)
-
-    return round(sum / len(list_of_sequences),0)
+    return average_class_count(list_of_sequences, aliphatic_residues, num_aliphatic)
 
 def num_aromatic(protein_seq):
-    return protein_seq.count("F") + protein_seq.count("Y") + protein_seq.count("W")
+    return count_residues(protein_seq, aromatic_residues)
 
 def average_num_aromatic(list_of_sequences):
-    sum = 0
-    for seq in list_of_sequences:
-        sum += num_aromatic(seq)
-
-    return round(sum / len(list_of_sequences),0)
+    return average_class_count(list_of_sequences, aromatic_residues, num_aromatic)
 
 def average_protein_length(list_of_sequences):
-    sum = 0
+    if isinstance(list_of_sequences, SequenceCorpus):
+        return round(int(list_of_sequences.lengths().sum()) / len(list_of_sequences),0)
 
+    sum = 0
+    count = 0
     for seq in list_of_sequences:
         sum += len(seq)
+        count += 1
 
-    return round(sum / len(list_of_sequences),0)
+    return round(sum / count,0)
 
 def percent_negative_charge(protein_seq):
     return round(num_negative_charge(protein_seq) / len(protein_seq),2)
 
 def average_percent_negative_charge(list_of_sequences):
-    return round(average_num_negative_charge(list_of_sequences) / average_protein_length(list_of_sequences),2)
+    return average_class_percent(list_of_sequences, negative_residues, num_negative_charge)
 
 def percent_positive_charge(protein_seq):
     return round(num_positive_charge(protein_seq) / len(protein_seq),2)
 
 def average_percent_positive_charge(list_of_sequences):
-    return round(average_num_positive_charge(list_of_sequences) / average_protein_length(list_of_sequences),2)
+    return average_class_percent(list_of_sequences, positive_residues, num_positive_charge)
 
 def percent_hydrophobic(protein_seq):
     return round(num_hydrophobic(protein_seq) / len(protein_seq),2)
 
 def average_percent_hydrophobic(list_of_sequences):
-    return round(average_num_hydrophobic(list_of_sequences) / average_protein_length(list_of_sequences),2)
+    return average_class_percent(list_of_sequences, hydrophobic_residues, num_hydrophobic)
 
 def percent_hydrophilic(protein_seq):
     return round(num_hydrophilic(protein_seq) / len(protein_seq),2)
 
 def average_percent_hydrophilic(list_of_sequences):
-    return round(average_num_hydrophilic(list_of_sequences) / average_protein_length(list_of_sequences),2)
+    return average_class_percent(list_of_sequences, hydrophilic_residues, num_hydrophilic)
 
 def percent_aliphatic(protein_seq):
     return round(num_aliphatic(protein_seq) / len(protein_seq),2)
 
 def average_percent_aliphatic(list_of_sequences):
-    return round(average_num_aliphatic(list_of_sequences) / average_protein_length(list_of_sequences),2)
+    return average_class_percent(list_of_sequences, aliphatic_residues, num_aliphatic)
 
 def percent_aromatic(protein_seq):
     return round(num_aromatic(protein_seq) / len(protein_seq),2)
 
 def average_percent_aromatic(list_of_sequences):
-    return round(average_num_aromatic(list_of_sequences) / average_protein_length(list_of_sequences),2)
+    return average_class_percent(list_of_sequences, aromatic_residues, num_aromatic)
 
 def AA_Occurence(protein_seq):
 
-    # Counts the occurence of each amino acid in a protein sequence
+    # Counts the occurence of each amino acid in a protein sequence, read from its cached residue histogram
 
     aa_occurence_dic = {}
     list_of_aa = ["A", "G", "P", "V", "L", "I",
                   "M", "C", "F", "Y", "W", "H",
                   "K", "R", "Q", "N", "E", "D",
                   "S", "T", "U"]
+    histogram = residue_histogram(protein_seq)
     for residue in list_of_aa:
-        aa_occurence_dic[residue] = protein_seq.count(residue)
+        aa_occurence_dic[residue] = int(histogram[ord(residue)])
     return aa_occurence_dic
 
 def Avg_Occurence(list_of_sequences):
@@ -391,15 +763,24 @@ def Avg_Occurence(list_of_sequences):
                  "S", "T", "U"]
 
     average_occurence = {}
+    if isinstance(list_of_sequences, SequenceCorpus):
+        # The occurences of the whole corpus are counted at once
+        mean_counts = corpus_counts(list_of_sequences).mean(axis=0)
+        for letter in list_of_aa:
+            average_occurence[letter] = float(mean_counts[amino_acid_list.index(letter)])
+        return average_occurence
+
     for letter in list_of_aa:
         average_occurence[letter] = 0
+    count = 0
     for seq in list_of_sequences:
         aa_occurence = AA_Occurence(seq)
         for aa in aa_occurence:
             average_occurence[aa] += aa_occurence[aa]
+        count += 1
 
     for aa in average_occurence:
-        average_occurence[aa] = average_occurence[aa] / len(list_of_sequences)
+        average_occurence[aa] = average_occurence[aa] / count
 
     return average_occurence
 
@@ -412,6 +793,7 @@ def AA_Composition(protein_seq):
         aa_composition_dic[aa] = round((aa_composition_dic[aa]/len(protein_seq))*100,2)
     return aa_composition_dic
 
+@feature_cache.cached("Avg_Composition")
 def Avg_Composition(list_of_sequences):
 
     # Utilizes AA_Composition to find the average composition for each amino acid in a list of protein sequences
@@ -422,65 +804,314 @@ def Avg_Composition(list_of_sequences):
                  "S", "T", "U"]
 
     average_composition = {}
+    scale = dataset_sum_scales["composition"]
+    if isinstance(list_of_sequences, SequenceCorpus):
+        # Same rounding as AA_Composition, but applied to the whole count matrix at once
+        counts = corpus_counts(list_of_sequences)[:, :len(amino_acid_list)]
+        compositions = np.round((counts / list_of_sequences.lengths()[:, None]) * 100, 2)
+        for letter in list_of_aa:
+            column = compositions[:, amino_acid_list.index(letter)]
+            average_composition[letter] = fixed_point_average(fixed_point_sum(column, scale), scale, len(list_of_sequences), 2)
+        return average_composition
+
+    # The compositions are added in fixed point (see fixed_point_sum), like export does
     for letter in list_of_aa:
         average_composition[letter] = 0
+    count = 0
     for seq in list_of_sequences:
         aa_composition = AA_Composition(seq)
         for aa in aa_composition:
-            average_composition[aa] += aa_composition[aa]
+            average_composition[aa] += fixed_point_sum(aa_composition[aa], scale)
+        count += 1
 
     for aa in average_composition:
-        average_composition[aa] = round(average_composition[aa] / len(list_of_sequences),2)
+        average_composition[aa] = fixed_point_average(average_composition[aa], scale, count, 2)
 
     return average_composition
 
-def Protein_Molecular_Weight(protein_seq):
-
-    # Amino acids molecular weight (Dalton) source: https://worldwide.promega.com/resources/tools/amino-acid-chart-amino-acid-structure/#:~:text=The%20average%20molecular%20weight%20of,(kDa)%20is%201%2C000%20daltons
+def residue_value_sums(data, tables, ambiguous="error", missing="raise"):
+
+    # Sums the values of a lookup table (see lookup_tables) over every sequence of data, without a Python loop over residues:
+    # the table is applied to the packed residues with np.take, then the per-sequence sums are segment sums at the offsets (np.add.reduceat)
+    # The sums are exact (fixed point integers), so they do not depend on how the data is chunked
+    # data is a sequence, a list of sequences or a SequenceCorpus; returns (sums, number of residues counted) as arrays, one entry per sequence
+    # ambiguous is the policy for residues that have no value:
+    # - "error": they have no value (like a dictionary lookup)
+    # - "average" gives B, Z, J and X the mean value of the residues they stand for, anything else (e.g. O) still has no value
+    # - "ignore" skips them: they count neither in the sum nor in the number of residues
+    # missing is what happens to a residue left without a value: "raise" raises a KeyError for the first of them,
+    # ... "nan" gives NaN to the sum of its sequence, so one odd protein does not abort a whole dataset
+
+    if ambiguous not in ("error", "average", "ignore"):
+        raise ValueError("Unknown ambiguous residue policy: " + str(ambiguous))
+    if missing not in ("raise", "nan"):
+        raise ValueError("Unknown missing residue policy: " + str(missing))
+    table = tables[1] if ambiguous == "average" else tables[0]
+    if isinstance(data, str):
+        data = [data]
+    chunks = data.chunks() if isinstance(data, SequenceCorpus) else sequence_chunks(data)
+    sums = []
+    counts = []
+    for chunk in chunks:
+        residues = np.asarray(chunk.residues)
+        lengths = chunk.lengths()
+        known = np.take(table.known, residues)
+        unresolved = ambiguous != "ignore" and not known.all()
+        if unresolved and missing == "raise":
+            raise KeyError(chr(int(residues[np.argmin(known)])))
+        if not len(residues):
+            sums.append(np.zeros(len(chunk)))
+            counts.append(np.zeros(len(chunk), dtype=np.int64))
+            continue
+        # reduceat runs from one start to the next, so it only gets the starts of the non-empty sequences (empty ones keep 0)
+        filled = lengths > 0
+        starts = (np.asarray(chunk.offsets[:-1]) - chunk.offsets[0])[filled]
+        segment_sums = np.zeros(len(chunk))
+        segment_sums[filled] = np.add.reduceat(np.take(table.values, residues), starts, dtype=np.int64) / table.scale
+        known_counts = np.zeros(len(chunk), dtype=np.int64)
+        known_counts[filled] = np.add.reduceat(known, starts, dtype=np.int64)
+        if unresolved:
+            segment_sums[known_counts < lengths] = np.nan
+        sums.append(segment_sums)
+        counts.append(known_counts if ambiguous == "ignore" else lengths)
+    if not sums:
+        return np.zeros(0), np.zeros(0, dtype=np.int64)
+    return np.concatenate(sums), np.concatenate(counts)
+
+def molecular_weights(data, ambiguous="average"):
+
+    # Molecular weight of every sequence of a sequence / list / SequenceCorpus (same formula as Protein_Molecular_Weight), as an array
+    # See residue_value_sums for the ambiguous residue policy; with "ignore", the skipped residues are not part of the chain either
+
+    masses, counts = residue_value_sums(data, mass_tables, ambiguous)
+    return np.round(masses - 18 * (counts - 1), 2)
+
+def hydrophobicity_totals(data, ambiguous="average"):
+
+    # Total Kyte-Doolittle hydrophobicity of every sequence (same value as get_total_hydrophobicity), as an array
+
+    return np.round(residue_value_sums(data, hydrophobicity_tables, ambiguous)[0], 2)
+
+def gravy_scores(data, ambiguous="average"):
+
+    # GRAVY (grand average of hydropathy) of every sequence: its total hydrophobicity divided by the number of residues counted
+    # Sequences without any counted residue get NaN
+
+    totals, counts = residue_value_sums(data, hydrophobicity_tables, ambiguous)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+def sequence_value_sum(protein_seq, tables, ambiguous="error"):
+
+    # residue_value_sums of a single sequence, as (sum, number of residues counted)
+    # It reads the cached residue histogram instead of packing the sequence into a corpus: the 256 counts times the fixed point table
+    # ... give the same exact sum, for a few microseconds whatever the length
+
+    if ambiguous not in ("error", "average", "ignore"):
+        raise ValueError("Unknown ambiguous residue policy: " + str(ambiguous))
+    table = tables[1] if ambiguous == "average" else tables[0]
+    histogram = residue_histogram(protein_seq)
+    count = int(histogram[table.known].sum())
+    if ambiguous != "ignore" and count < len(protein_seq):
+        # Like a dictionary lookup, the KeyError names the first residue without a value
+        raise KeyError(next(aa for aa in protein_seq if ord(aa) > 255 or not table.known[ord(aa)]))
+    return int(histogram @ table.values) / table.scale, count
+
+def Protein_Molecular_Weight(protein_seq, ambiguous="error"):
+
+    # Amino acids molecular weights (Dalton) are in aa_mass_dic at the top of this file
     # Molecular weight can be found by adding the Daltons of each amino acid to a counter --> protein_moelcular_weight
     # The trick is to subtract 18 * (length - 1) at the end because for every two residues to connect, a water molecule is lost
     # That is why there is the 18 * (len(protein_seq) - 1) part...
+    # The Daltons are added by sequence_value_sum, from a lookup table; by default an unknown residue raises a KeyError (see residue_value_sums)
 
-    aa_mass_dic = {"A": 89, "G": 75, "P": 115, "V": 117, "L": 131, "I": 131,
-                  "M": 149, "C": 121, "F": 165, "Y": 181, "W": 204, "H": 155,
-                  "K": 146, "R": 174, "Q": 146, "N": 132, "E": 147, "D": 133,
-                  "S": 105, "T": 119, "U": 167}
-    protein_molecular_weight = 0
-    for aa in protein_seq:
-        protein_molecular_weight += aa_mass_dic[aa]
-
-    protein_molecular_weight = round(protein_molecular_weight - (18 * (len(protein_seq) - 1)),2)
+    mass, count = sequence_value_sum(protein_seq, mass_tables, ambiguous)
+    protein_molecular_weight = round(mass - 18 * (count - 1), 2)
+    # The weights of the 21 residues are integers, so is the weight of a protein made of them
+    if protein_molecular_weight.is_integer():
+        return int(protein_molecular_weight)
     return protein_molecular_weight
 
 def Avg_molecular_weight(list_of_sequences):
 
     # Utilizes the above function to calculate average molecualr weight in a list of protein sequences
+    # For a SequenceCorpus, the weights of all sequences are computed at once by molecular_weights
+
+    if isinstance(list_of_sequences, SequenceCorpus):
+        weights = molecular_weights(list_of_sequences, "error")
+        return round(float(weights.sum()) / len(list_of_sequences),2)
 
     summ = 0
+    count = 0
     for seq in list_of_sequences:
         summ += Protein_Molecular_Weight(seq)
-    return round(summ / len(list_of_sequences),2)
+        count += 1
+    return round(summ / count,2)
 
-def get_total_hydrophobicity(protein_seq):
+def get_total_hydrophobicity(protein_seq, ambiguous="error"):
 
-    # Finds the total hydrophobicity of a protein sequence based on Kyte-Doolittle scale
+    # Finds the total hydrophobicity of a protein sequence based on Kyte-Doolittle scale (aa_hydrophobicity)
+    # The values are read from a lookup table by sequence_value_sum; by default an unknown residue raises a KeyError (see residue_value_sums)
 
-    aa_hydrophobicity = {'I': 4.50, 'V': 4.20, 'L': 3.80, 'F': 2.80, 'C': 2.50, 'M': 1.90, 'A': 1.80, 'G': -0.40, 'T': -0.70, 'S': -0.80,
-                         'W': -0.90,'Y': -1.30, 'P': -1.60, 'H': -3.20, 'E': -3.50, 'N': -3.50, 'Q': -3.50, 'D': -3.50, 'K': -3.90, 'R': -4.50, 'U': 2.50}
-    total_hydrophobicity = 0
-    for aa in protein_seq:
-        total_hydrophobicity += aa_hydrophobicity[aa]
-    return round(total_hydrophobicity,2)
+    return round(sequence_value_sum(protein_seq, hydrophobicity_tables, ambiguous)[0], 2)
 
 def get_average_hydrophobicity(list_of_proteins):
 
     # Utilizes the above function to calculate average hydrophobicity in a list of protein sequences
+    # For a SequenceCorpus, the hydrophobicity of all sequences is computed at once by hydrophobicity_totals
+    # The totals are added in fixed point (see fixed_point_sum), like export does
+
+    scale = dataset_sum_scales["hydrophobicity"]
+    if isinstance(list_of_proteins, SequenceCorpus):
+        totals = hydrophobicity_totals(list_of_proteins, "error")
+        return fixed_point_average(fixed_point_sum(totals, scale), scale, len(list_of_proteins), 2)
 
     sum_hydrophobicity = 0
+    count = 0
     for protein in list_of_proteins:
-        sum_hydrophobicity += get_total_hydrophobicity(protein)
-    avg_hydrophobicity = sum_hydrophobicity/len(list_of_proteins)
-    return round(avg_hydrophobicity,2)
+        sum_hydrophobicity += fixed_point_sum(get_total_hydrophobicity(protein), scale)
+        count += 1
+    return fixed_point_average(sum_hydrophobicity, scale, count, 2)
+
+def scan_isoelectric_point_from_counts(counts, terminals):
+
+    # Vectorized isoelectric_point (the step model scanned from pH 2.0 to 12.5), for the arrays given by ionizable_counts
+    # Gives the mean of the pH values isoelectric_point would return for every sequence, which is what export reports as "Mean"
+
+    grid = np.arange(2.0, 12.6, 0.1)
+    charges = charge_matrix_from_counts(counts, terminals, grid, "step")
+    zero = charges == 0
+    zero_count = zero.sum(axis=1)
+    zero_mean = (zero * grid).sum(axis=1) / np.maximum(zero_count, 1)
+    # Like isoelectric_point, the first pH of the smallest positive / least negative charge, and pH 7 when there is none
+    positive = np.where(charges > 0, charges, np.inf)
+    negative = np.where(charges < 0, charges, -np.inf)
+    pH_min_positive = np.where(np.isfinite(positive.min(axis=1, initial=np.inf)), grid[positive.argmin(axis=1)], 7)
+    pH_min_negative = np.where(np.isfinite(negative.max(axis=1, initial=-np.inf)), grid[negative.argmax(axis=1)], 7)
+    return np.where(zero_count > 0, zero_mean, (pH_min_positive + pH_min_negative) / 2)
+
+def feature_table(corpus, ids=None, ambiguous="average"):
+
+    # Every metric of export for every sequence of a SequenceCorpus, as one pandas DataFrame with one row per protein
+    # All the columns come from two count matrices (all residues and ionizable residues), so there is no per-protein Python loop:
+    # id, length, molecular_weight, net_charge_pH7, isoelectric_point (continuous), isoelectric_point_scan (mean of isoelectric_point),
+    # hydrophobicity, num_* / percent_* for the six residue classes and composition_* for the 21 residues
+    # molecular_weight and hydrophobicity follow the ambiguous residue policy of residue_value_sums ("average" like molecular_weights),
+    # ... and are NaN for sequences with a residue that the policy leaves without a value (any unknown residue with "error")
+
+    if ids is None:
+        ids = corpus.ids if corpus.ids is not None else np.arange(len(corpus))
+    counts = corpus_counts(corpus)
+    known = counts[:, :len(amino_acid_list)]
+    lengths = corpus.lengths()
+    ionizable = known[:, [amino_acid_list.index(aa) for aa in side_chain_pKa]]
+    terminals = terminal_pKas(corpus)
+
+    masses, mass_counts = residue_value_sums(corpus, mass_tables, ambiguous, "nan")
+    hydrophobicity = residue_value_sums(corpus, hydrophobicity_tables, ambiguous, "nan")[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns = {
+            "id": np.asarray(ids),
+            "length": lengths,
+            "molecular_weight": np.round(masses - 18 * (mass_counts - 1), 2),
+            "net_charge_pH7": charge_from_counts(ionizable, terminals, 7.0, "step"),
+            "isoelectric_point": isoelectric_point_from_counts(ionizable, terminals),
+            "isoelectric_point_scan": scan_isoelectric_point_from_counts(ionizable, terminals),
+            "hydrophobicity": np.round(hydrophobicity, 2),
+        }
+        for name, residues in [("positive_charge", positive_residues), ("negative_charge", negative_residues),
+                               ("hydrophobic", hydrophobic_residues), ("hydrophilic", hydrophilic_residues),
+                               ("aliphatic", aliphatic_residues), ("aromatic", aromatic_residues)]:
+            number = known[:, [amino_acid_list.index(aa) for aa in residues]].sum(axis=1)
+            columns["num_" + name] = number
+            columns["percent_" + name] = np.round(number / lengths, 2)
+        for column, aa in enumerate(amino_acid_list):
+            columns["composition_" + aa] = np.round((known[:, column] / lengths) * 100, 2)
+    return pd.DataFrame(columns)
+
+def source_chunks(source, chunk_size=10000):
+
+    # Splits any dataset into SequenceCorpus chunks of chunk_size sequences, reading it only once:
+    # a FASTA file name, a SequenceCorpus, or an iterable of sequences or of (accession, description, sequence) records
+    # Records keep their accessions as ids; plain sequences are numbered from 0
+
+    if isinstance(source, str):
+        source = fetch.read_fasta(source)
+    if isinstance(source, SequenceCorpus):
+        for start in range(0, len(source), chunk_size):
+            chunk = source.slice(start, min(start + chunk_size, len(source)))
+            if chunk.ids is None:
+                chunk.ids = np.arange(start, start + len(chunk))
+            yield chunk
+        return
+    sequences = []
+    ids = []
+    for index, item in enumerate(source):
+        if isinstance(item, str):
+            ids.append(index)
+            sequences.append(item)
+        else:
+            ids.append(item[0])
+            sequences.append(item[2])
+        if len(sequences) == chunk_size:
+            yield SequenceCorpus.from_sequences(sequences, ids)
+            sequences = []
+            ids = []
+    if sequences:
+        yield SequenceCorpus.from_sequences(sequences, ids)
+
+def characterize_table(source, chunk_size=10000, ambiguous="average"):
+
+    # Feature table (see feature_table) of a whole dataset in one DataFrame
+    # Use export_table instead for datasets that do not fit in memory
+
+    tables = [feature_table(chunk, ambiguous=ambiguous) for chunk in source_chunks(source, chunk_size)]
+    if not tables:
+        return feature_table(SequenceCorpus.from_sequences([]), [], ambiguous)
+    return pd.concat(tables, ignore_index=True)
+
+def export_table(source, file_name, format=None, chunk_size=10000, workers=1, ambiguous="average"):
+
+    # Writes the feature table of a dataset (see feature_table / source_chunks) to a CSV, Parquet or JSON Lines file
+    # The dataset is read, characterized and written chunk by chunk, so a whole proteome streams through in bounded memory
+    # format is "csv", "parquet" or "jsonl", by default it is taken from the file extension
+    # Parquet needs pyarrow, an optional dependency (not in requirements.txt): without it, an ImportError says so before anything is written
+    # ambiguous is the ambiguous residue policy of feature_table
+    # With workers > 1 (0 = one per CPU), the chunks are characterized in a process pool while this process reads the input
+    # ... and writes the finished chunks in input order, so the output is the same as with a single process
+
+    if format is None:
+        format = file_name.rsplit(".", 1)[-1].lower()
+    if format not in ("csv", "parquet", "jsonl"):
+        raise ValueError("Unknown table format: " + str(format))
+    if format == "parquet":
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet export needs the optional pyarrow package (pip install pyarrow), or use the csv / jsonl format")
+
+    writer = None
+    rows = 0
+    with open(file_name, "wb" if format == "parquet" else "w", newline="" if format == "csv" else None) as exported_file:
+        for table in parallel.ordered_map(partial(feature_table, ambiguous=ambiguous), source_chunks(source, chunk_size), workers):
+            if format == "csv":
+                table.to_csv(exported_file, index=False, header=(rows == 0))
+            elif format == "jsonl":
+                table.to_json(exported_file, orient="records", lines=True)
+            else:
+                arrow_table = pyarrow.Table.from_pandas(table, preserve_index=False)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(exported_file, arrow_table.schema)
+                writer.write_table(arrow_table)
+            rows += len(table)
+        if format == "parquet" and writer is None:
+            # An empty dataset still gives a valid (empty) Parquet file
+            table = feature_table(SequenceCorpus.from_sequences([]), [], ambiguous)
+            pyarrow.parquet.write_table(pyarrow.Table.from_pandas(table, preserve_index=False), exported_file)
+        elif writer is not None:
+            writer.close()
+    return rows
 
 def composition_plot(protein, num=1):
 
@@ -504,62 +1135,129 @@ def composition_plot(protein, num=1):
 
     plt.show()
 
-def export(input, name, file_name, num=1):
+def dataset_sums(chunk):
+
+    # Sums over a SequenceCorpus chunk of every per-protein value that the list mode of export averages
+    # Chunks are summarized independently (possibly in different processes) and their sums are added up by add_sums
+    # The sums are integers (fixed point, see fixed_point_sum), so the averages do not depend on how the dataset was split
+    # Like Avg_molecular_weight, a residue without a molecular weight raises a KeyError
+
+    check_corpus_residues(chunk, aa_mass_dic)
+    table = feature_table(chunk, ambiguous="error")
+    sums = {"count": len(table)}
+    for column in ["length", "molecular_weight", "net_charge_pH7", "isoelectric_point_scan", "hydrophobicity"] + \
+                  ["num_" + name for name in ["positive_charge", "negative_charge", "hydrophobic", "hydrophilic", "aliphatic", "aromatic"]] + \
+                  ["composition_" + aa for aa in amino_acid_list]:
+        scale = dataset_sum_scales.get(column, dataset_sum_scales.get(column.split("_")[0], 1))
+        sums[column] = fixed_point_sum(table[column].to_numpy(dtype=float), scale)
+    occurence = corpus_counts(chunk)[:, :len(amino_acid_list)].sum(axis=0)
+    for column, aa in enumerate(amino_acid_list):
+        sums["occurence_" + aa] = int(occurence[column])
+    return sums
+
+def dataset_average(sums, column, digits):
+    scale = dataset_sum_scales.get(column, dataset_sum_scales.get(column.split("_")[0], 1))
+    return fixed_point_average(sums[column], scale, sums["count"], digits)
+
+def add_sums(sums_1, sums_2):
+    return {key: sums_1[key] + sums_2[key] for key in sums_1}
+
+def feature_statistics(chunk):
+
+    # Running statistics (aggregates.RunningStats) of every numeric column of the feature table of a SequenceCorpus chunk
+    # Unlike dataset_sums, unknown residues do not raise: they leave NaN weights / hydrophobicities, which are not counted
+
+    table = feature_table(chunk, ambiguous="error")
+    statistics = aggregates.RunningStats([column for column in table.columns if column != "id"])
+    return statistics.update(table)
+
+def dataset_statistics(source, chunk_size=10000, workers=1):
+
+    # Count, mean, standard deviation, min and max of every per-protein feature of a dataset (see feature_table)
+    # source is anything source_chunks reads (FASTA file name, SequenceCorpus, iterable of sequences / records); it is read once,
+    # ... chunk by chunk, and with workers > 1 (0 = one per CPU) the chunks are summarized in a process pool and merged in input order
+    # Returns a DataFrame with one row per feature
+
+    statistics = None
+    for chunk_statistics in parallel.ordered_map(feature_statistics, source_chunks(source, chunk_size), workers):
+        statistics = chunk_statistics if statistics is None else statistics.merge(chunk_statistics)
+    if statistics is None:
+        statistics = feature_statistics(SequenceCorpus.from_sequences([]))
+    return pd.DataFrame.from_dict(statistics.summary(), orient="index")
+
+def export(input, name, file_name, num=1, workers=1, chunk_size=10000):
 
     # The main function that is used to export all the information about the sequence to a .txt file
     # input is the protein sequence(s)
     # name is the protein name / list name
     # file_name is the name of the file to which info will be exported
     # num is the number of proteins in the input, 1 by default
+    # For a list of proteins, input can also be a SequenceCorpus or a FASTA file name, and it is read only once:
+    # ... it is split into chunks of chunk_size proteins, summarized by dataset_sums on `workers` processes (0 = one per CPU)
 
-    exported_file = open(file_name, "w")
     amino_acids = "ACDEFGHIKLMNPQRSTVWYU"
 
-    # For exporting information of an individual protein
-    if num == 1:
-        exported_file.writelines("Protein name: " + name + "\n")
-        exported_file.writelines("Protein sequence: " + input + "\n")
-        exported_file.writelines("Protein length: " + str(len(input)) + "\n")
-        exported_file.writelines("Protein molecular weight: " + str(Protein_Molecular_Weight(input)) + "\n")
-        exported_file.writelines("Protein net charge at pH = 7: " + str(total_charge(input, 7)) + "\n")
-        exported_file.writelines("Protein isoelectric point range: " + str(round(isoelectric_point(input)[0],1)) + " - " + str(round(isoelectric_point(input)[-1],1)) + " | Mean: " + str(round(sum(isoelectric_point(input)) / len(isoelectric_point(input)), 2)) + "\n")
-        exported_file.writelines("Protein net hydrophobicity: " + str(get_total_hydrophobicity(input)) + "\n")
-        exported_file.writelines("Number of positively charged residues: " + str(num_positive_charge(input))+ " and their percentage: " + str(percent_positive_charge(input)) + "\n")
-        exported_file.writelines("Number of negatively charged residues: "+ str(num_negative_charge(input)) + " and their percentage: " + str(percent_negative_charge(input)) + "\n")
-        exported_file.writelines("Number of hydrophobic residues: "+ str(num_hydrophobic(input)) + " and their percentage: " + str(percent_hydrophobic(input)) + "\n")
-        exported_file.writelines("Number of hydrophilic residues: "+ str(num_hydrophilic(input))+ " and their percentage: " + str(percent_hydrophilic(input)) + "\n")
-        exported_file.writelines("Number of aliphatic residues: " + str(num_aliphatic(input)) + " and their percentage: " + str(percent_aliphatic(input)) + "\n")
-        exported_file.writelines("Number of aromatic residues: " + str(num_aromatic(input)) + " and their percentage: " + str(percent_aromatic(input)) + "\n")
-
-        exported_file.writelines("\n")
-        exported_file.writelines("AA" + "\t" + "Occurence" + "\t" + "Composition" + "\n")
-        occurence = AA_Occurence(input)
-        composition = AA_Composition(input)
-        for i in range(20):
-            a = amino_acids[i]
-            exported_file.writelines(a + "\t" + str(occurence[a]) + "\t" + str(composition[a]) + "\n")
-            exported_file.writelines("\n")
+    if num != 1:
+        # The list is summarized before the file is opened, so an empty dataset does not leave an empty report behind
+        sums = None
+        for chunk_sums in parallel.ordered_map(dataset_sums, source_chunks(input, chunk_size), workers):
+            sums = chunk_sums if sums is None else add_sums(sums, chunk_sums)
+        if sums is None:
+            raise ValueError("Can not export the averages of an empty list of proteins")
+
+    with open(file_name, "w") as exported_file:
+        # For exporting information of an individual protein
+        if num == 1:
+            exported_file.writelines("Protein name: " + name + "\n")
+            exported_file.writelines("Protein sequence: " + input + "\n")
+            exported_file.writelines("Protein length: " + str(len(input)) + "\n")
+            exported_file.writelines("Protein molecular weight: " + str(Protein_Molecular_Weight(input)) + "\n")
+            exported_file.writelines("Protein net charge at pH = 7: " + str(total_charge(input, 7)) + "\n")
+            iso = isoelectric_point(input)
+            exported_file.writelines("Protein isoelectric point range: " + str(round(iso[0],1)) + " - " + str(round(iso[-1],1)) + " | Mean: " + str(round(sum(iso) / len(iso), 2)) + "\n")
+            exported_file.writelines("Protein net hydrophobicity: " + str(get_total_hydrophobicity(input)) + "\n")
+            exported_file.writelines("Number of positively charged residues: " + str(num_positive_charge(input))+ " and their percentage: " + str(percent_positive_charge(input)) + "\n")
+            exported_file.writelines("Number of negatively charged residues: "+ str(num_negative_charge(input)) + " and their percentage: " + str(percent_negative_charge(input)) + "\n")
+            exported_file.writelines("Number of hydrophobic residues: "+ str(num_hydrophobic(input)) + " and their percentage: " + str(percent_hydrophobic(input)) + "\n")
+            exported_file.writelines("Number of hydrophilic residues: "+ str(num_hydrophilic(input))+ " and their percentage: " + str(percent_hydrophilic(input)) + "\n")
+            exported_file.writelines("Number of aliphatic residues: " + str(num_aliphatic(input)) + " and their percentage: " + str(percent_aliphatic(input)) + "\n")
+            exported_file.writelines("Number of aromatic residues: " + str(num_aromatic(input)) + " and their percentage: " + str(percent_aromatic(input)) + "\n")
 
-    # For exporting information of a list of protein sequences
-    else:
-        exported_file.writelines("Protein list name: " + name + "\n")
-        exported_file.writelines("Dataset protein count: " + str(len(input)) + "\n")
-        exported_file.writelines("Average protein length: " + str(average_protein_length(input)) + "\n")
-        exported_file.writelines("Average protein molecular weight: " + str(Avg_molecular_weight(input)) + "\n")
-        exported_file.writelines("Average protein net charge at pH = 7: " + str(average_total_charge(input, 7)) + "\n")
-        exported_file.writelines("Average protein isoelectric point: " + str(average_isoelectric_point(input)) + "\n")
-        exported_file.writelines("Average protein hydrophobicity: " + str(get_average_hydrophobicity(input)) + "\n")
-        exported_file.writelines("Average number of positively charged residues: " + str(average_num_positive_charge(input))+ " and their percentage: " + str(average_percent_positive_charge(input)) + "\n")
-        exported_file.writelines("Average number of negatively charged residues: "+ str(average_num_negative_charge(input)) + " and their percentage: " + str(average_percent_negative_charge(input)) + "\n")
-        exported_file.writelines("Average number of hydrophobic residues: "+ str(average_num_hydrophobic(input)) + " and their percentage: " + str(average_percent_hydrophobic(input)) + "\n")
-        exported_file.writelines("Average number of hydrophilic residues: "+ str(average_num_hydrophilic(input))+ " and their percentage: " + str(average_percent_hydrophilic(input)) + "\n")
-        exported_file.writelines("Average number of aliphatic residues: " + str(average_num_aliphatic(input)) + " and their percentage: " + str(average_percent_aliphatic(input)) + "\n")
-        exported_file.writelines("Average number of aromatic residues: " + str(average_num_aromatic(input)) + " and their percentage: " + str(average_percent_aromatic(input)) + "\n")
-        exported_file.writelines("\n")
-        exported_file.writelines("AA" + "\t" + "Occurence" + "\t" + "Composition" + "\n")
-        avg_occurence = Avg_Occurence(input)
-        avg_composition = Avg_Composition(input)
-        for i in range(20):
-            a = amino_acids[i]
-            exported_file.writelines(a + "\t" + str(avg_occurence[a]) + "\t" + str(avg_composition[a]) + "\n")
-            exported_file.writelines("\n")
\ No newline at end of file
+            exported_file.writelines("\n")
+            exported_file.writelines("AA" + "\t" + "Occurence" + "\t" + "Composition" + "\n")
+            occurence = AA_Occurence(input)
+            composition = AA_Composition(input)
+            for i in range(20):
+                a = amino_acids[i]
+                exported_file.writelines(a + "\t" + str(occurence[a]) + "\t" + str(composition[a]) + "\n")
+                exported_file.writelines("\n")
+
+        # For exporting information of a list of protein sequences
+        # The averages are the ones of the average_* / Avg_* functions (same rounding), computed from the summed chunks
+        else:
+            count = sums["count"]
+            length = dataset_average(sums, "length", 0)
+
+            def class_line(label, column):
+                average_number = dataset_average(sums, "num_" + column, 0)
+                return "Average number of " + label + " residues: " + str(average_number) + " and their percentage: " + str(round(average_number / length, 2)) + "\n"
+
+            exported_file.writelines("Protein list name: " + name + "\n")
+            exported_file.writelines("Dataset protein count: " + str(count) + "\n")
+            exported_file.writelines("Average protein length: " + str(length) + "\n")
+            exported_file.writelines("Average protein molecular weight: " + str(dataset_average(sums, "molecular_weight", 2)) + "\n")
+            exported_file.writelines("Average protein net charge at pH = 7: " + str(dataset_average(sums, "net_charge_pH7", 1)) + "\n")
+            exported_file.writelines("Average protein isoelectric point: " + str(dataset_average(sums, "isoelectric_point_scan", 1)) + "\n")
+            exported_file.writelines("Average protein hydrophobicity: " + str(dataset_average(sums, "hydrophobicity", 2)) + "\n")
+            exported_file.writelines(class_line("positively charged", "positive_charge"))
+            exported_file.writelines(class_line("negatively charged", "negative_charge"))
+            exported_file.writelines(class_line("hydrophobic", "hydrophobic"))
+            exported_file.writelines(class_line("hydrophilic", "hydrophilic"))
+            exported_file.writelines(class_line("aliphatic", "aliphatic"))
+            exported_file.writelines(class_line("aromatic", "aromatic"))
+            exported_file.writelines("\n")
+            exported_file.writelines("AA" + "\t" + "Occurence" + "\t" + "Composition" + "\n")
+            for i in range(20):
+                a = amino_acids[i]
+                exported_file.writelines(a + "\t" + str(sums["occurence_" + a] / count) + "\t" + str(dataset_average(sums, "composition_" + a, 2)) + "\n")
+                exported_file.writelines("\n")
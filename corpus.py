@@ -0,0 +1,134 @@
+import os
+import numpy as np
+
+class SequenceCorpus:
+
+    # Compact storage for a whole dataset of protein sequences
+    # residues is one contiguous uint8 buffer holding every sequence back to back (as ASCII codes)
+    # offsets is an int64 array of length n + 1, so sequence i is residues[offsets[i]:offsets[i + 1]]
+    # ids optionally holds the accession of every sequence
+    # Compared to a list of Python strings, this costs 1 byte per residue + 8 bytes per sequence, and NumPy can work on all of it at once
+
+    def __init__(self, residues, offsets, ids=None):
+        self.residues = residues
+        self.offsets = offsets
+        self.ids = ids
+
+    @classmethod
+    def from_sequences(cls, sequences, ids=None):
+
+        # Packs any iterable of sequence strings (a list, a generator, etc.) without keeping the strings around
+
+        buffer = bytearray()
+        offsets = [0]
+        for seq in sequences:
+            buffer += seq.encode("ascii")
+            offsets.append(len(buffer))
+        residues = np.frombuffer(bytes(buffer), dtype=np.uint8)
+        if ids is not None:
+            ids = np.array(list(ids))
+        return cls(residues, np.array(offsets, dtype=np.int64), ids)
+
+    @classmethod
+    def from_records(cls, records):
+
+        # Packs an iterable of (accession, description, sequence) records, such as the ones yielded by fetch.read_fasta
+
+        ids = []
+
+        def sequences():
+            for record in records:
+                ids.append(record[0])
+                yield record[2]
+
+        corpus = cls.from_sequences(sequences())
+        corpus.ids = np.array(ids, dtype=str)
+        return corpus
+
+    def save(self, directory):
+
+        # Saves the corpus as .npy files in a directory, so it can later be memory-mapped by load
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "residues.npy"), np.asarray(self.residues))
+        np.save(os.path.join(directory, "offsets.npy"), np.asarray(self.offsets))
+        if self.ids is not None:
+            np.save(os.path.join(directory, "ids.npy"), np.asarray(self.ids))
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+
+        # Loads a corpus saved by save; by default the arrays are memory-mapped instead of read into memory
+
+        mode = "r" if mmap else None
+        residues = np.load(os.path.join(directory, "residues.npy"), mmap_mode=mode)
+        offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode=mode)
+        ids_file = os.path.join(directory, "ids.npy")
+        ids = np.load(ids_file, mmap_mode=mode) if os.path.exists(ids_file) else None
+        return cls(residues, offsets, ids)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("Corpus slices must be contiguous")
+            return self.slice(start, stop)
+        if i < 0:
+            i += len(self)
+        return self.residues[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("ascii")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def slice(self, start, stop):
+
+        # Returns the sequences start..stop-1 as a new corpus that shares the residue buffer (no copy)
+
+        offsets = self.offsets[start:stop + 1]
+        residues = self.residues[offsets[0]:offsets[-1]] if len(offsets) else self.residues[:0]
+        ids = self.ids[start:stop] if self.ids is not None else None
+        return SequenceCorpus(residues, offsets - offsets[0] if len(offsets) else offsets, ids)
+
+    def chunks(self, max_residues=2 ** 22):
+
+        # Yields consecutive sub-corpora holding at most max_residues residues each (or a single longer sequence)
+        # This bounds the memory used by the per-residue temporaries of the vectorized functions
+
+        n = len(self)
+        start = 0
+        while start < n:
+            stop = int(np.searchsorted(self.offsets, self.offsets[start] + max_residues, side="right")) - 1
+            stop = min(max(stop, start + 1), n)
+            yield self.slice(start, stop)
+            start = stop
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def sequence_index(self):
+
+        # Array of the same length as residues, telling for each residue which sequence it belongs to
+
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.lengths())
+
+    def residue_counts(self, alphabet):
+
+        # Counts every letter of alphabet in every sequence with a single bincount per chunk
+        # The result has one row per sequence and len(alphabet) + 1 columns, the last column counting all other characters
+
+        k = len(alphabet) + 1
+        lookup = np.full(256, k - 1, dtype=np.int64)
+        for column, letter in enumerate(alphabet):
+            lookup[ord(letter)] = column
+        counts = []
+        for chunk in self.chunks():
+            index = chunk.sequence_index() * k + lookup[chunk.residues]
+            counts.append(np.bincount(index, minlength=len(chunk) * k).reshape(len(chunk), k))
+        if not counts:
+            return np.zeros((0, k), dtype=np.int64)
+        return np.concatenate(counts)
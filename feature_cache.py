@@ -0,0 +1,190 @@
+import os
+import sys
+import copy
+import pickle
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+import numpy as np
+
+def sequence_key(data):
+
+    # Key identifying a sequence, a list of sequences or a SequenceCorpus, used to key the cached features
+    # A single sequence is its own key: Python caches the hash of a string, so a lookup costs no pass over the sequence
+    # Lists and corpora are hashed (blake2b), lists as their sequences joined with newlines (which never appear in a sequence)
+    # Anything else (e.g. a generator, which hashing would consume) has no key and is never cached
+
+    if isinstance(data, str):
+        return data
+    digest = hashlib.blake2b(digest_size=16)
+    if hasattr(data, "residues") and hasattr(data, "offsets"):
+        digest.update(b"corpus")
+        digest.update(np.ascontiguousarray(data.residues).tobytes())
+        digest.update(np.ascontiguousarray(data.offsets).tobytes())
+    elif isinstance(data, (list, tuple)):
+        digest.update(b"list")
+        for seq in data:
+            digest.update(seq.encode("utf-8"))
+            digest.update(b"\n")
+    else:
+        return None
+    return digest.hexdigest()
+
+def estimate_size(value):
+
+    # Rough number of bytes held by a cached value or key (NumPy arrays, strings, numbers and nested dicts / lists / tuples)
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+def frozen(value):
+
+    # Values are shared through the cache, so arrays are made read-only and containers are copied on the way in and out
+    # ... otherwise a caller modifying its result (like AA_Composition does with AA_Occurence's dictionary) would corrupt the cache
+
+    if isinstance(value, np.ndarray):
+        value = value.copy() if value.flags.writeable else value
+        value.flags.writeable = False
+        return value
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+class FeatureCache:
+
+    # Bounded memoization of per-sequence features, shared by characterization, categorization and structure_prediction
+    # Only the expensive features use it (isoelectric points, secondary structures, dataset averages): for a cheap count,
+    # ... building the key and copying the result in and out costs more than computing it again (see benchmark.cache_benchmark)
+    # Entries are keyed by (feature name, the sequence or a hash of the sequences, extra arguments)
+    # - the in-process tier is an LRU holding at most max_bytes (estimated), least recently used entries are evicted first
+    # - if a directory is given, every entry is also pickled there, and memory misses are looked up on disk before computing
+    # hits / misses / evictions / disk_hits are counted so the budget can be sized (see stats)
+
+    def __init__(self, max_bytes=64 * 2 ** 20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self.lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _disk_path(self, key):
+        name = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.directory, name + ".pkl")
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return frozen(self.entries[key][0])
+        if self.directory is not None:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = None
+            else:
+                with self.lock:
+                    self.disk_hits += 1
+                self._remember(key, frozen(value))
+                return frozen(value)
+        with self.lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        value = frozen(value)
+        self._remember(key, value)
+        if self.directory is not None:
+            path = self._disk_path(key)
+            with open(path + "." + str(threading.get_ident()) + ".tmp", 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(path + "." + str(threading.get_ident()) + ".tmp", path)
+
+    def _remember(self, key, value):
+        # The key is counted too, it holds the whole sequence for single sequences (see sequence_key)
+        size = estimate_size(value) + estimate_size(key)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, (old_value, old_size) = self.entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "disk_hits": self.disk_hits,
+                    "entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+_default_cache = None
+
+def default_cache():
+
+    # The cache shared by every module, configured through environment variables:
+    # FEATURE_CACHE_MAX_BYTES (default 64 MiB, 0 disables the cache) and FEATURE_CACHE_DIR (disk tier, off by default)
+
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FeatureCache(int(os.environ.get("FEATURE_CACHE_MAX_BYTES", 64 * 2 ** 20)),
+                                      os.environ.get("FEATURE_CACHE_DIR") or None)
+    return _default_cache
+
+def configure(max_bytes=64 * 2 ** 20, directory=None):
+
+    # Replaces the shared cache, e.g. to give it a larger budget or a disk tier
+
+    global _default_cache
+    _default_cache = FeatureCache(max_bytes, directory)
+    return _default_cache
+
+def stats():
+    return default_cache().stats()
+
+_missing = object()
+
+def cached(name):
+
+    # Decorator memoizing a feature function whose first argument is a sequence (or a list of sequences / a SequenceCorpus)
+    # The remaining arguments must be hashable, they are part of the key
+    # The cache is looked up at call time, so configure() also applies to functions decorated before it was called
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(data, *args, **kwargs):
+            cache = default_cache()
+            data_key = sequence_key(data) if cache.max_bytes > 0 else None
+            if data_key is None:
+                return function(data, *args, **kwargs)
+            key = (name, data_key, args, tuple(sorted(kwargs.items())))
+            value = cache.get(key, _missing)
+            if value is _missing:
+                value = function(data, *args, **kwargs)
+                if isinstance(value, np.ndarray):
+                    # Frozen in place rather than copied, the caller gets the same read-only array as later hits
+                    value.flags.writeable = False
+                cache.put(key, value)
+            return value
+        return wrapper
+    return decorator
@@ -1,36 +1,379 @@
+import os
+import mmap
+import time
+import threading
 import requests
+import http_cache
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from corpus import SequenceCorpus
+
+# A FASTA record as yielded by read_fasta: the accession (e.g. "P21796"), the rest of the header line and the full sequence
+FastaRecord = namedtuple("FastaRecord", ["accession", "description", "sequence"])
+
+# The outcome of one request of fetch_many: the requested id, the parsed result (None on failure) and the exception raised (None on success)
+FetchResult = namedtuple("FetchResult", ["id", "result", "error"])
+
+def parse_header(header):
+
+    # Splits a FASTA header line into its accession and its description
+    # UniProt headers look like ">sp|P21796|VDAC1_HUMAN Voltage-dependent anion-selective channel protein 1 OS=Homo sapiens ..."
+    # ... so for "db|accession|entry" identifiers the accession is the second field, otherwise it is the whole first word
+
+    header = header.lstrip(">").strip()
+    fields = header.split(None, 1)
+    if not fields:
+        return "", ""
+    identifier = fields[0]
+    description = fields[1] if len(fields) > 1 else ""
+    parts = identifier.split("|")
+    if len(parts) > 1 and parts[1] != "":
+        identifier = parts[1]
+    return identifier, description
+
+def records_from_lines(lines):
+
+    # Generator that turns an iterable of FASTA lines into FastaRecord tuples, one record at a time
+    # The sequence lines of a record are collected in a list and joined once, so building a record is linear in its length
+    # Only the record currently being read is held in memory
+
+    header = None
+    seq_lines = []
+    for line in lines:
+        if line[:1] == ">":
+            if header is not None or seq_lines:
+                accession, description = parse_header(header or "")
+                yield FastaRecord(accession, description, "".join(seq_lines))
+            header = line
+            seq_lines = []
+        else:
+            seq_lines.append(line.rstrip())
+    if header is not None or seq_lines:
+        accession, description = parse_header(header or "")
+        yield FastaRecord(accession, description, "".join(seq_lines))
+
+def read_fasta(file):
+
+    # This is a lazy parsing function for FASTA files
+    # It yields (accession, description, sequence) records as the file is read, so huge proteome files are processed in constant memory
+
+    with open(file, 'r') as inFile:
+        for record in records_from_lines(inFile):
+            yield record
 
 def parse_sequences(file):
 
     # This is a parsing function for FASTA files
+    # It returns the list of sequences only, use read_fasta to keep the headers or to avoid loading the whole file
+    # Records without any residue are skipped (read_fasta yields them), so every sequence of the list has a non-zero length
 
-    inFile = open(file, 'r')
-    seqList = []
-    currentSeq = ''
-    for line in inFile:
-        if line[0] == ">":
-            if currentSeq != '':
-                seqList.append(currentSeq)
-            currentSeq = ''
-        else:
-            currentSeq += line.rstrip()
-    seqList.append(currentSeq)
+    return [record.sequence for record in read_fasta(file) if record.sequence]
+
+def records_from_chunks(chunks, tee=None):
+
+    # Incremental FASTA parser fed by raw byte chunks, such as the ones given by requests' iter_content
+    # A line that is split across two chunks is carried over until its end arrives, so records are yielded as soon as they are complete
+    # If tee is an open binary file, every chunk is also written to it as it arrives
+
+    def lines():
+        pending = b""
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if tee is not None:
+                tee.write(chunk)
+            pending += chunk
+            complete = pending.split(b"\n")
+            pending = complete.pop()
+            for line in complete:
+                yield line.decode("utf-8")
+        if pending:
+            yield pending.decode("utf-8")
+
+    return records_from_lines(lines())
+
+def tee_records(chunks, Name=None):
+
+    # Parses FASTA records from byte chunks, saving the raw bytes to <Name>.fasta when a Name is given
+
+    if Name is None:
+        for record in records_from_chunks(chunks):
+            yield record
+    else:
+        with open(Name + ".fasta", 'wb') as f:
+            for record in records_from_chunks(chunks, tee=f):
+                yield record
+
+def stream_proteins(URL, Name=None, chunk_size=2 ** 16, use_cache=True):
+
+    # Generator that downloads a FASTA file and yields its records while the download is still running
+    # Nothing is written to disk unless a Name is given, in which case the raw download is also saved to <Name>.fasta
+    # The download goes through the shared HTTP cache (see http_cache), so a repeated query is read back from the cache instead
+
+    if use_cache:
+        for record in tee_records(http_cache.default_cache().stream(URL, chunk_size=chunk_size), Name):
+            yield record
+    else:
+        with requests.get(URL, stream=True) as request:
+            request.raise_for_status()
+            for record in tee_records(request.iter_content(chunk_size=chunk_size), Name):
+                yield record
+
+class RateLimiter:
+
+    # Token bucket shared by the worker threads of fetch_many
+    # Tokens are added at `rate` per second up to `burst`, and every request takes one, waiting if the bucket is empty
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+def make_session(pool_size=10):
+
+    # A requests.Session whose connection pool keeps up to pool_size keep-alive connections per host
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_with_retry(session, URL, limiter=None, retries=5, backoff=0.5, use_cache=True, **kwargs):
+
+    # GET through a session, retrying connection errors, timeouts, 429 and 5xx answers with exponential backoff
+    # A numeric Retry-After header from the server is used instead of the backoff delay when present
+    # The response of the last attempt is returned even if it is still an error, so the caller decides what to do with it
+    # The limiter only takes a token for requests that go to the network, a response served from the cache does not wait
+
+    acquire = limiter.acquire if limiter is not None else None
+    for attempt in range(retries + 1):
+        try:
+            if use_cache:
+                response = http_cache.default_cache().get(URL, session=session, before_request=acquire, **kwargs)
+            else:
+                if acquire is not None:
+                    acquire()
+                response = session.get(URL, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+        if (response.status_code == 429 or response.status_code >= 500) and attempt < retries:
+            retry_after = response.headers.get("Retry-After", "")
+            time.sleep(float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt)
+            continue
+        return response
 
-    return seqList
+def parse_fasta_response(response):
 
-def fetch_proteins(URL, Name, num=1):
+    # Default parser of fetch_many: the first FASTA record of the response
 
-    # This code is provided by Uniprot URL to fetch proteins --> It gives a FASTA file, which is parsed by the above function
+    response.raise_for_status()
+    for record in records_from_lines(response.text.splitlines()):
+        return record
+    return None
 
-    with requests.get(URL, stream=True) as request:
-        request.raise_for_status()
-        n = Name + ".fasta"
-        with open(n, 'wb') as f:
-            for chunk in request.iter_content(chunk_size=2 ** 20):
-                f.write(chunk)
-    sequencesList = parse_sequences(n)
+def fetch_many(ids, url_template="https://rest.uniprot.org/uniprotkb/{}.fasta", parse=parse_fasta_response, max_workers=8,
+               rate=10, burst=None, retries=5, backoff=0.5, timeout=30, use_cache=True):
+
+    # Fetches many entries (e.g. UniProt accessions) concurrently, and yields a FetchResult for each as soon as it completes
+    # - url_template is formatted with every id to get its URL, parse turns each response into the result
+    # - at most max_workers requests run at the same time, over one pooled keep-alive session
+    # - rate is the maximum number of requests per second (token bucket, bursts of up to burst), None for no limit
+    # - 429 / 5xx answers and connection errors are retried with exponential backoff (see get_with_retry)
+    # ids can be any iterable, it is consumed progressively so that at most 2 * max_workers requests are pending
+
+    session = make_session(max_workers)
+    limiter = RateLimiter(rate, burst or max_workers) if rate else None
+
+    def task(identifier):
+        try:
+            response = get_with_retry(session, url_template.format(identifier), limiter, retries, backoff, use_cache, timeout=timeout)
+            return FetchResult(identifier, parse(response), None)
+        except Exception as error:
+            return FetchResult(identifier, None, error)
+
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for identifier in ids:
+            pending.add(executor.submit(task, identifier))
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def build_corpus(source, directory=None):
+
+    # Packs a FASTA file (or any iterable of (accession, description, sequence) records) into a SequenceCorpus
+    # The file is streamed, so only the packed residues are ever held in memory
+    # If a directory is given, the corpus is also saved there, and can be memory-mapped later with SequenceCorpus.load(directory)
+
+    if isinstance(source, str):
+        source = read_fasta(source)
+    corpus = SequenceCorpus.from_records(source)
+    if directory is not None:
+        corpus.save(directory)
+    return corpus
+
+def fetch_proteins(URL, Name, num=1, lazy=False, use_cache=True):
+
+    # This code is provided by Uniprot URL to fetch proteins --> It gives a FASTA file, which is saved as <Name>.fasta
+    # The records are parsed from the download stream itself, so the saved file is never read back
+    # If lazy is True, an iterator of (accession, description, sequence) records is returned instead of a list / joined string
+    # Set use_cache to False to always download from Uniprot, bypassing the shared HTTP cache
+
+    records = stream_proteins(URL, Name, use_cache=use_cache)
+    if lazy:
+        return records
+    sequencesList = [record.sequence for record in records if record.sequence]
     if num == 1:
         sequencesList = "".join(sequencesList)
         return sequencesList
     else:
-        return sequencesList
\ No newline at end of file
+        return sequencesList
+
+def build_fasta_index(file):
+
+    # Builds a faidx-style index next to a FASTA file (<file>.fai) in a single pass over the file
+    # Each line of the index is: accession, sequence length, byte offset of the sequence, residues per line, bytes per line
+    # Like samtools faidx, every sequence line of a record except the last one must have the same length
+
+    index_file = file + ".fai"
+    entries = []
+    seen = set()
+    with open(file, 'rb') as inFile:
+        position = 0
+        current = None
+        short_line = False
+        for line in inFile:
+            if line[:1] == b">":
+                if current is not None:
+                    entries.append(current)
+                accession = parse_header(line.decode("utf-8"))[0]
+                if accession in seen:
+                    raise ValueError("Duplicate accession in " + file + ": " + accession)
+                seen.add(accession)
+                # [accession, length, offset, line bases, line width]
+                current = [accession, 0, position + len(line), 0, 0]
+                short_line = False
+            elif current is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if bases > 0:
+                    if current[3] == 0:
+                        current[3] = bases
+                        current[4] = len(line)
+                    elif short_line or bases > current[3]:
+                        raise ValueError("Different line lengths in record " + current[0] + " of " + file)
+                    if bases < current[3]:
+                        short_line = True
+                    current[1] += bases
+                else:
+                    short_line = True
+            position += len(line)
+        if current is not None:
+            entries.append(current)
+
+    with open(index_file, 'w') as outFile:
+        for entry in entries:
+            outFile.write("\t".join(str(field) for field in entry) + "\n")
+    return index_file
+
+def load_fasta_index(index_file):
+
+    # Reads a .fai file into a dictionary: accession --> (length, offset, line bases, line width)
+
+    index = {}
+    with open(index_file, 'r') as inFile:
+        for line in inFile:
+            fields = line.rstrip("\n").split("\t")
+            index[fields[0]] = tuple(int(field) for field in fields[1:5])
+    return index
+
+class IndexedFasta:
+
+    # Random-access reader over a FASTA file and its .fai index
+    # The index is built once (and rebuilt only when the FASTA file is newer than it)
+    # The FASTA file is memory-mapped, so fetching a record or a sub-range only reads the bytes it needs
+
+    def __init__(self, file, rebuild=False):
+        index_file = file + ".fai"
+        if rebuild or not os.path.exists(index_file) or os.path.getmtime(index_file) < os.path.getmtime(file):
+            build_fasta_index(file)
+        self.file = file
+        self.index = load_fasta_index(index_file)
+        self._handle = open(file, 'rb')
+        if os.path.getsize(file) > 0:
+            self._map = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = None
+
+    def _byte_position(self, offset, linebases, linewidth, position):
+        # Converts a 0-based residue position into a byte position in the file
+        return offset + (position // linebases) * linewidth + position % linebases
+
+    def fetch(self, accession, start=1, end=None):
+
+        # Returns the residues start..end (1-based, inclusive, like the searching functions) of a record
+        # The whole sequence is returned by default
+
+        length, offset, linebases, linewidth = self.index[accession]
+        if end is None or end > length:
+            end = length
+        if start < 1:
+            start = 1
+        if length == 0 or start > end:
+            return ""
+        byte_start = self._byte_position(offset, linebases, linewidth, start - 1)
+        byte_end = self._byte_position(offset, linebases, linewidth, end - 1) + 1
+        raw = self._map[byte_start:byte_end]
+        return raw.replace(b"\n", b"").replace(b"\r", b"").decode("ascii")
+
+    def length(self, accession):
+        return self.index[accession][0]
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, accession):
+        return self.fetch(accession)
+
+    def __contains__(self, accession):
+        return accession in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,170 @@
+import os
+import numpy as np
+from corpus import SequenceCorpus
+
+class FMIndex:
+
+    # Full-text index of a whole SequenceCorpus (e.g. a reference proteome), built once and then queried many times
+    # The sequences are concatenated with a separator after each one and a terminator at the end; the index holds
+    # - the suffix array of that text (positions of its suffixes in sorted order), built with NumPy by prefix doubling
+    # - its Burrows-Wheeler transform, with the counts of every letter at every `step` positions (checkpoints)
+    # count is a backward search: two rank queries per letter of the pattern, so its cost depends on the pattern length, not on the corpus
+    # locate reads the matching range of the suffix array and converts the positions to (sequence id, start, end),
+    # ... with the 1-based inclusive coordinates of searching.Naive / BoyerMoore / KMP
+    # Letters are stored as small codes: 0 is the terminator, 1 the separator, then the letters of the corpus in byte order
+
+    def __init__(self, bwt, suffix_array, checkpoints, first, letters, starts, ids=None, step=64):
+        self.bwt = bwt
+        self.suffix_array = suffix_array
+        self.checkpoints = checkpoints
+        self.first = first
+        self.letters = letters
+        self.starts = starts
+        self.ids = ids
+        self.step = step
+        self.codes = np.zeros(256, dtype=np.int64)
+        self.codes[np.asarray(letters)] = np.arange(2, len(letters) + 2)
+
+    @classmethod
+    def build(cls, corpus, step=64):
+
+        # corpus is a SequenceCorpus or a list of sequences
+
+        if not isinstance(corpus, SequenceCorpus):
+            corpus = SequenceCorpus.from_sequences(corpus)
+        residues = np.asarray(corpus.residues)
+        offsets = np.asarray(corpus.offsets)
+        letters = np.unique(residues).astype(np.uint8)
+        lookup = np.zeros(256, dtype=np.uint8)
+        lookup[letters] = np.arange(2, len(letters) + 2)
+
+        # Sequence i starts at offsets[i] + i in the text, each separator shifting the following sequences by one
+        count = len(corpus)
+        size = len(residues) + count + 1
+        text = np.ones(size, dtype=np.uint8)
+        text[-1] = 0
+        text[np.arange(len(residues)) + corpus.sequence_index()] = lookup[residues]
+        starts = offsets[:-1] + np.arange(count)
+
+        suffix_array = suffix_array_by_doubling(text)
+        bwt = text[suffix_array - 1]
+
+        # first[c] is the number of letters smaller than c, i.e. where the suffixes starting with c begin in the suffix array
+        letter_counts = np.bincount(text, minlength=len(letters) + 2)
+        first = np.concatenate(([0], np.cumsum(letter_counts)[:-1]))
+        # checkpoints[k, c] is the number of c in bwt[:k * step]
+        blocks = np.zeros((size // step + 1, len(letters) + 2), dtype=np.int64)
+        block_index = np.arange(size) // step + 1
+        np.add.at(blocks, (block_index[block_index < len(blocks)], bwt[block_index < len(blocks)]), 1)
+        checkpoints = np.cumsum(blocks, axis=0)
+
+        index_type = np.int32 if size < 2 ** 31 else np.int64
+        return cls(bwt, suffix_array.astype(index_type), checkpoints, first, letters, starts, corpus.ids, step)
+
+    def save(self, directory):
+
+        # Saves the index as .npy files in a directory, so it can later be memory-mapped by load
+
+        os.makedirs(directory, exist_ok=True)
+        for name in ["bwt", "suffix_array", "checkpoints", "first", "letters", "starts"]:
+            np.save(os.path.join(directory, name + ".npy"), np.asarray(getattr(self, name)))
+        np.save(os.path.join(directory, "step.npy"), np.array(self.step))
+        if self.ids is not None:
+            np.save(os.path.join(directory, "ids.npy"), np.asarray(self.ids))
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+
+        # Loads an index saved by save; by default the large arrays are memory-mapped instead of read into memory
+
+        mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mode)
+                  for name in ["bwt", "suffix_array", "checkpoints"]}
+        small = {name: np.load(os.path.join(directory, name + ".npy")) for name in ["first", "letters", "starts"]}
+        ids_file = os.path.join(directory, "ids.npy")
+        ids = np.load(ids_file, mmap_mode=mode) if os.path.exists(ids_file) else None
+        return cls(arrays["bwt"], arrays["suffix_array"], arrays["checkpoints"], small["first"], small["letters"], small["starts"],
+                   ids, int(np.load(os.path.join(directory, "step.npy"))))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def occurrences_before(self, code, position):
+
+        # Number of code in bwt[:position]: the last checkpoint before position, plus a count over less than step letters
+
+        block = position // self.step
+        return int(self.checkpoints[block, code]) + int(np.count_nonzero(self.bwt[block * self.step:position] == code))
+
+    def suffix_range(self, pattern):
+
+        # Backward search: the range [low, high) of the suffix array holding the suffixes that start with pattern
+
+        low = 0
+        high = len(self.bwt)
+        for letter in reversed(pattern.encode("ascii", errors="replace")):
+            code = int(self.codes[letter])
+            if code == 0:
+                return 0, 0
+            low = int(self.first[code]) + self.occurrences_before(code, low)
+            high = int(self.first[code]) + self.occurrences_before(code, high)
+            if low >= high:
+                return 0, 0
+        return low, high
+
+    def count(self, pattern):
+
+        # Number of occurrences of pattern in the whole corpus (overlapping ones included)
+
+        if not pattern:
+            raise ValueError("The pattern can not be empty")
+        low, high = self.suffix_range(pattern)
+        return high - low
+
+    def locate(self, pattern):
+
+        # Every occurrence of pattern as (sequence id, start, end), sorted by sequence then start
+        # The sequence id is the corpus id when the corpus has ids, otherwise the sequence number
+
+        if not pattern:
+            raise ValueError("The pattern can not be empty")
+        low, high = self.suffix_range(pattern)
+        positions = np.sort(np.asarray(self.suffix_array[low:high], dtype=np.int64))
+        sequences = np.searchsorted(self.starts, positions, side="right") - 1
+        starts = positions - self.starts[sequences] + 1
+        ids = self.ids[sequences].tolist() if self.ids is not None else sequences.tolist()
+        return [(sequence_id, start, start + len(pattern) - 1) for sequence_id, start in zip(ids, starts.tolist())]
+
+    def search(self, pattern, sequence):
+
+        # Matches of pattern in one sequence of the corpus (given by number), as the (start, end) tuples of searching.KMP
+
+        if not pattern:
+            raise ValueError("The pattern can not be empty")
+        low, high = self.suffix_range(pattern)
+        positions = np.asarray(self.suffix_array[low:high], dtype=np.int64)
+        end = self.starts[sequence + 1] if sequence + 1 < len(self.starts) else len(self.bwt)
+        positions = np.sort(positions[(positions >= self.starts[sequence]) & (positions < end)]) - self.starts[sequence] + 1
+        return [(start, start + len(pattern) - 1) for start in positions.tolist()]
+
+def suffix_array_by_doubling(text):
+
+    # Suffix array of a uint8 text ending with a unique smallest letter (0), by prefix doubling:
+    # suffixes are sorted by their first 1, 2, 4, ... letters, each round sorting (rank of the first half, rank of the second half)
+    # ... packed into one int64 key, until all the ranks are different
+
+    size = len(text)
+    rank = text.astype(np.int64)
+    shift = 1
+    while True:
+        second = np.zeros(size, dtype=np.int64)
+        second[:size - shift] = rank[shift:] + 1
+        key = rank * (size + 1) + second
+        suffix_array = np.argsort(key, kind="stable")
+        sorted_key = key[suffix_array]
+        rank = np.empty(size, dtype=np.int64)
+        rank[suffix_array] = np.concatenate(([0], np.cumsum(sorted_key[1:] != sorted_key[:-1])))
+        if rank[suffix_array[-1]] == size - 1:
+            return suffix_array
+        shift *= 2
@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+class OfflineCacheMiss(requests.exceptions.RequestException):
+    # Raised in offline mode when a request has no cached response
+    pass
+
+class CachedResponse:
+
+    # Minimal stand-in for requests.Response, built from a cache entry
+    # It has the parts the fetchers use: status_code, headers, content, text, json(), raise_for_status() and iter_content()
+    # from_cache tells whether the network was skipped (or answered 304 Not Modified)
+
+    def __init__(self, url, status_code, headers, content, from_cache):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode(get_encoding_from_headers(self.headers) or "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code) + " Error for url: " + self.url, response=self)
+
+    def iter_content(self, chunk_size=2 ** 16):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+def normalize_url(URL, params=None):
+
+    # Builds one canonical form of a URL and its query parameters, so that the same request always gets the same cache key
+    # The scheme and host are lowercased and the query parameters (from the URL and from params) are sorted
+
+    parts = urlsplit(URL)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += [(str(key), str(value)) for key, value in dict(params).items()]
+    query.sort()
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", urlencode(query), ""))
+
+class HttpCache:
+
+    # On-disk HTTP cache shared by fetch and the apps, keyed by a SHA-256 of the normalized URL + params
+    # Every entry is a <key>.body file with the response content and a <key>.json file with its metadata
+    # - entries younger than ttl seconds are served without any network access
+    # - older entries are revalidated with If-None-Match / If-Modified-Since, a 304 answer refreshes them without a download
+    # - the total size is kept under max_bytes by evicting the least recently used entries
+    # ... the size is a running total (one directory scan when the cache is opened), the directory is only listed again to evict
+    # - in offline mode only cached entries are served, whatever their age, and a miss raises OfflineCacheMiss
+
+    def __init__(self, directory, ttl=7 * 24 * 3600, max_bytes=2 ** 30, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.bytes = self.size()
+
+    def key(self, URL, params=None):
+        return hashlib.sha256(normalize_url(URL, params).encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".body", base + ".json"
+
+    def _load_meta(self, key):
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(body_path):
+            return None
+        return meta
+
+    def _write_meta(self, key, meta):
+        meta_path = self._paths(key)[1]
+        with open(meta_path + "." + str(threading.get_ident()) + ".tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + "." + str(threading.get_ident()) + ".tmp", meta_path)
+
+    def _touch(self, key):
+        # The body's modification time is used as the "last used" time for LRU eviction
+        try:
+            os.utime(self._paths(key)[0])
+        except OSError:
+            pass
+
+    def _read_body(self, key):
+        with open(self._paths(key)[0], 'rb') as f:
+            return f.read()
+
+    def _meta_from_response(self, URL, response, size):
+        headers = {}
+        for name in ("Content-Type", "ETag", "Last-Modified"):
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        return {"url": URL, "status_code": response.status_code, "headers": headers, "stored_at": time.time(), "size": size}
+
+    def _conditional_headers(self, meta, headers=None):
+        headers = dict(headers or {})
+        if "ETag" in meta["headers"]:
+            headers["If-None-Match"] = meta["headers"]["ETag"]
+        if "Last-Modified" in meta["headers"]:
+            headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+        return headers
+
+    def _count(self, counter):
+        # The counters are updated from the worker threads of fetch.fetch_many, so every increment takes the lock
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _refresh(self, key, meta):
+        meta["stored_at"] = time.time()
+        self._write_meta(key, meta)
+
+    def _cached_response(self, key, meta):
+        self._touch(key)
+        return CachedResponse(meta["url"], meta["status_code"], meta["headers"], self._read_body(key), True)
+
+    def get(self, URL, params=None, session=None, headers=None, before_request=None, **kwargs):
+
+        # Cached equivalent of requests.get(URL, params=params, headers=headers, **kwargs)
+        # Only 200 responses are stored; anything else is returned without being cached
+        # before_request is called just before a request goes to the network (e.g. to take a rate limiter token), never for a cache hit
+
+        key = self.key(URL, params)
+        meta = self._load_meta(key)
+        if meta is not None and (self.offline or time.time() - meta["stored_at"] < self.ttl):
+            self._count("hits")
+            return self._cached_response(key, meta)
+        if self.offline:
+            self._count("misses")
+            raise OfflineCacheMiss("Not in the HTTP cache (offline mode): " + normalize_url(URL, params))
+
+        getter = session.get if session is not None else requests.get
+        if before_request is not None:
+            before_request()
+        if meta is not None:
+            try:
+                response = getter(URL, params=params, headers=self._conditional_headers(meta, headers), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                # A stale entry is better than nothing when the server can not be reached (or does not answer in time)
+                self._count("hits")
+                return self._cached_response(key, meta)
+            if response.status_code == 304:
+                self._count("revalidations")
+                self._refresh(key, meta)
+                return self._cached_response(key, meta)
+        else:
+            response = getter(URL, params=params, headers=headers, **kwargs)
+
+        self._count("misses")
+        if response.status_code == 200:
+            self.store(key, URL, response, response.content)
+        return CachedResponse(URL, response.status_code, dict(response.headers), response.content, False)
+
+    def stream(self, URL, params=None, chunk_size=2 ** 16, session=None, **kwargs):
+
+        # Generator of the raw content chunks of a response, for large downloads such as UniProt FASTA streams
+        # A cached entry is read back from disk in chunks
+        # Otherwise the download is streamed to the caller and written to the cache at the same time
+        # The entry is only stored once the download is complete, so an interrupted download never leaves a truncated entry
+
+        key = self.key(URL, params)
+        meta = self._load_meta(key)
+        fresh = meta is not None and (self.offline or time.time() - meta["stored_at"] < self.ttl)
+        if meta is None and self.offline:
+            self._count("misses")
+            raise OfflineCacheMiss("Not in the HTTP cache (offline mode): " + normalize_url(URL, params))
+
+        response = None
+        if not fresh:
+            getter = session.get if session is not None else requests.get
+            headers = self._conditional_headers(meta) if meta is not None else None
+            try:
+                response = getter(URL, params=params, headers=headers, stream=True, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                # Like get: a stale entry is better than nothing when the server can not be reached
+                if meta is None:
+                    raise
+                response = None
+            if response is not None and response.status_code == 304:
+                response.close()
+                response = None
+                self._count("revalidations")
+                self._refresh(key, meta)
+
+        if response is None:
+            self._count("hits")
+            self._touch(key)
+            with open(self._paths(key)[0], 'rb') as f:
+                chunk = f.read(chunk_size)
+                while chunk:
+                    yield chunk
+                    chunk = f.read(chunk_size)
+            return
+
+        self._count("misses")
+        with response:
+            response.raise_for_status()
+            body_path = self._paths(key)[0]
+            temp_path = body_path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".part"
+            size = 0
+            try:
+                with open(temp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        size += len(chunk)
+                        yield chunk
+                if response.status_code == 200:
+                    replaced = self._body_size(key)
+                    os.replace(temp_path, body_path)
+                    self._write_meta(key, self._meta_from_response(URL, response, size))
+                    self._added(size - replaced)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def store(self, key, URL, response, content):
+
+        # Writes an entry atomically (temporary file + rename), then enforces the size limit
+
+        body_path = self._paths(key)[0]
+        temp_path = body_path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".part"
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        replaced = self._body_size(key)
+        os.replace(temp_path, body_path)
+        self._write_meta(key, self._meta_from_response(URL, response, len(content)))
+        self._added(len(content) - replaced)
+
+    def _body_size(self, key):
+        # Size of the body an entry is about to replace (0 for a new entry), so the running total stays right
+        try:
+            return os.path.getsize(self._paths(key)[0])
+        except OSError:
+            return 0
+
+    def _added(self, size):
+        # Updates the running total after a write, and evicts only once it is over the limit
+        with self.lock:
+            self.bytes += size
+            over = self.bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def entries(self):
+
+        # List of (last used time, size, key) for every complete entry of the cache
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".body"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".body")]))
+        return entries
+
+    def size(self):
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+
+        # Removes the least recently used entries until the cache holds at most max_bytes
+        # The directory is listed here, so the running total is also corrected for entries written by other processes
+
+        entries = sorted(self.entries())
+        total = sum(entry[1] for entry in entries)
+        evicted = 0
+        for last_used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            evicted += 1
+        with self.lock:
+            self.bytes = total
+            self.evictions += evicted
+
+    def clear(self):
+        for last_used, size, key in self.entries():
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        with self.lock:
+            self.bytes = 0
+
+_default_cache = None
+
+def default_cache():
+
+    # The cache shared by every module, configured through environment variables:
+    # PROTEIN_CACHE_DIR (default ~/.cache/proteinAnalysisApp), PROTEIN_CACHE_TTL in seconds (default one week),
+    # PROTEIN_CACHE_MAX_BYTES (default 1 GiB) and PROTEIN_CACHE_OFFLINE=1 for offline mode
+
+    global _default_cache
+    if _default_cache is None:
+        directory = os.environ.get("PROTEIN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "proteinAnalysisApp"))
+        _default_cache = HttpCache(directory,
+                                   ttl=float(os.environ.get("PROTEIN_CACHE_TTL", 7 * 24 * 3600)),
+                                   max_bytes=int(os.environ.get("PROTEIN_CACHE_MAX_BYTES", 2 ** 30)),
+                                   offline=os.environ.get("PROTEIN_CACHE_OFFLINE", "") not in ("", "0"))
+    return _default_cache
+
+def cached_get(URL, params=None, **kwargs):
+
+    # Drop-in replacement for requests.get that goes through the shared cache
+
+    return default_cache().get(URL, params=params, **kwargs)
@@ -2,7 +2,8 @@
 
 import io
 import streamlit as st
-import requests
+import http_cache
+import fetch
 from Bio import SeqIO, SeqUtils
 from Bio.SeqUtils.ProtParam import ProteinAnalysis
 import networkx as nx
@@ -16,11 +17,9 @@ KD = {"A": 1.8, "R": -4.5, "N": -3.5, "D": -3.5, "C": 2.5,
       "L": 3.8, "K": -3.9, "M": 1.9, "F": 2.8, "P": -1.6,
       "S": -0.8, "T": -0.7, "W": -0.9, "Y": -1.3, "V": 4.2}
 
-# Function to fetch protein data from UniProt
-def fetch_protein_data(uniprot_id):
-    url = f"https://www.uniprot.org/uniprot/{uniprot_id}.fasta"
-    response = requests.get(url)
-    record = SeqIO.read(io.StringIO('\n'.join(response.text.splitlines())), "fasta")
+# Function to build the protein data from a UniProt FASTA entry
+def protein_data_from_fasta(fasta_text):
+    record = SeqIO.read(io.StringIO('\n'.join(fasta_text.splitlines())), "fasta")
 
     try:
         molecular_weight = SeqUtils.molecular_weight(record.seq)
@@ -33,12 +32,26 @@ def fetch_protein_data(uniprot_id):
         "molecular_weight": molecular_weight
     }
 
+# Function to fetch protein data from UniProt
+def fetch_protein_data(uniprot_id):
+    url = f"https://www.uniprot.org/uniprot/{uniprot_id}.fasta"
+    response = http_cache.cached_get(url)
+    return protein_data_from_fasta(response.text)
+
+# Function to fetch protein data for many UniProt IDs at once
+# Results are yielded as (uniprot_id, data, error) as soon as each request completes (see fetch.fetch_many)
+def fetch_protein_data_batch(uniprot_ids, max_workers=8, rate=10):
+    def parse(response):
+        response.raise_for_status()
+        return protein_data_from_fasta(response.text)
+
+    return fetch.fetch_many(uniprot_ids, "https://www.uniprot.org/uniprot/{}.fasta", parse, max_workers=max_workers, rate=rate)
 
 # Function to fetch protein-protein interaction network from STRING DB
 def fetch_ppi_network(uniprot_id):
     url = f"https://string-db.org/api/json/interaction_partners?identifiers={uniprot_id}"
     try:
-        response = requests.get(url)
+        response = http_cache.cached_get(url)
         response.raise_for_status()  # Raise an exception for 4xx and 5xx status codes
         data = response.json()
 
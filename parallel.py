@@ -0,0 +1,37 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+def default_workers():
+
+    # Number of worker processes used when workers=0 is passed: one per available CPU
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def ordered_map(function, items, workers=1, window=None):
+
+    # Generator applying function to every item of items across a process pool, yielding the results in input order
+    # items is consumed progressively: at most `window` tasks (2 per worker by default) are pending at a time,
+    # ... so a huge stream (e.g. the chunks of a proteome) is never loaded at once and the results can be written as they arrive
+    # function and the items must be picklable (a module-level function, NumPy arrays, SequenceCorpus chunks, ...)
+    # workers=1 runs everything in the current process, workers=0 uses one process per CPU
+
+    if workers == 0:
+        workers = default_workers()
+    if workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    window = window or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,3 +1,10 @@
+import numpy as np
+from collections import namedtuple
+import fetch
+import parallel
+import characterization
+from corpus import SequenceCorpus
+
 def Naive(pattern, sequence):
     pattern_length = len(pattern)  # corresponds to window size
     sequence_length = len(sequence)
@@ -93,4 +100,474 @@ def computeLPSArray(pat, M, lps):
                 # Also, note that we do not increment i here
             else:
                 lps[i] = 0
-                i += 1
\ No newline at end of file
+                i += 1
+
+
+class AhoCorasick:
+
+    # Multi-pattern search: the whole pattern set is compiled once into an automaton (Aho-Corasick),
+    # ... which then finds every occurrence of every pattern in a single pass over a sequence, whatever the number of patterns
+    # The automaton is a complete DFA over the letters of the patterns (a byte outside them goes back to the root),
+    # ... so scanning is one table lookup per residue
+    # Matches are (pattern, start, end) with the 1-based, inclusive coordinates of Naive / BoyerMoore / KMP, overlapping ones included
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(patterns))
+        if not self.patterns or any(len(pattern) == 0 for pattern in self.patterns):
+            raise ValueError("Aho-Corasick needs at least one pattern and no empty pattern")
+
+        # Letters of the patterns are numbered 1..k, every other byte is 0; translate() maps a whole sequence to those numbers at once
+        letters = sorted(set("".join(self.patterns)))
+        table = bytearray(256)
+        for number, letter in enumerate(letters):
+            table[ord(letter)] = number + 1
+        self.table = bytes(table)
+        width = len(letters) + 1
+
+        # Trie of the patterns: goto[state][letter number] is the next state (0 = no edge), outputs[state] the patterns ending there
+        goto = [[0] * width]
+        outputs = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for code in pattern.encode("ascii").translate(self.table):
+                if goto[state][code] == 0:
+                    goto.append([0] * width)
+                    outputs.append([])
+                    goto[state][code] = len(goto) - 1
+                state = goto[state][code]
+            outputs[state].append(index)
+
+        # Breadth-first pass adding the failure links: a missing edge is replaced by the edge of the longest proper suffix state,
+        # ... and every state also reports the patterns of that suffix state
+        fail = [0] * len(goto)
+        queue = []
+        for code in range(1, width):
+            if goto[0][code]:
+                queue.append(goto[0][code])
+        for state in queue:
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            for code in range(1, width):
+                next_state = goto[state][code]
+                if next_state:
+                    fail[next_state] = goto[fail[state]][code]
+                    queue.append(next_state)
+                else:
+                    goto[state][code] = goto[fail[state]][code]
+        self.goto = goto
+        self.outputs = [[(index, len(self.patterns[index])) for index in output] for output in outputs]
+
+    def search(self, sequence):
+
+        # All the matches in one sequence, as (pattern, start, end) sorted by start, then end
+
+        goto = self.goto
+        outputs = self.outputs
+        matches = []
+        state = 0
+        for i, code in enumerate(sequence.encode("ascii", errors="replace").translate(self.table)):
+            state = goto[state][code]
+            if outputs[state]:
+                for index, length in outputs[state]:
+                    matches.append((i - length + 2, i + 1, index))
+        matches.sort()
+        return [(self.patterns[index], start, end) for start, end, index in matches]
+
+    def search_records(self, records):
+
+        # Generator of (sequence id, pattern, start, end) over many sequences, one sequence at a time
+        # records can be (accession, description, sequence) records (fetch.read_fasta), plain sequences (numbered from 0) or a SequenceCorpus
+
+        if hasattr(records, "residues") and hasattr(records, "offsets"):
+            ids = records.ids if records.ids is not None else range(len(records))
+            records = zip(ids, records)
+        for number, record in enumerate(records):
+            if isinstance(record, str):
+                sequence_id, sequence = number, record
+            else:
+                sequence_id, sequence = record[0], record[-1]
+            for pattern, start, end in self.search(sequence):
+                yield (sequence_id, pattern, start, end)
+
+def multi_search(patterns, records):
+
+    # Searches every pattern of a set in many sequences with one Aho-Corasick automaton (see AhoCorasick.search_records)
+
+    return AhoCorasick(patterns).search_records(records)
+
+def search_fasta(patterns, file):
+
+    # Streams a FASTA file (read lazily, record by record) through multi_search, yielding (accession, pattern, start, end)
+
+    return multi_search(patterns, fetch.read_fasta(file))
+
+class PrositePattern:
+
+    # PROSITE motif (e.g. "C-x(2,4)-C-x(3)-[LIVMFYWC]") compiled into a chain of residue classes with repeat ranges
+    # Supported syntax: elements separated by "-", a letter, x (any residue), [ABC] (one of), {ABC} (none of),
+    # ... repeats (n) and (n,m), "<" at the start (N-terminal anchor), ">" at the end or as the last choice of the final [..] (C-terminal),
+    # ... and an optional final "."
+    # Matching is not a backtracking regex: the whole chain is evaluated for every position of a chunk of sequences at once with NumPy,
+    # ... in a single pass from the last element to the first, which gives for every start position the longest match beginning there
+    # Every start with a match is a hit, so overlapping hits are all reported, as 1-based inclusive (start, end) like Naive / KMP
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.anchored_start = False
+        self.anchored_end = False
+        self.end_choice = False
+        self.elements = []
+        text = "".join(pattern.split())
+        if text.endswith("."):
+            text = text[:-1]
+        if text.startswith("<"):
+            self.anchored_start = True
+            text = text[1:]
+        if text.endswith(">"):
+            self.anchored_end = True
+            text = text[:-1]
+        if not text:
+            raise ValueError("Empty PROSITE pattern")
+        parts = text.split("-")
+        for number, part in enumerate(parts):
+            self.elements.append(self.parse_element(part, number == len(parts) - 1))
+
+    def parse_element(self, part, last):
+
+        # Returns (table, minimum, maximum): table is a 256-entry boolean array telling which bytes the element matches
+
+        repeat = (1, 1)
+        if part.endswith(")") and "(" in part:
+            part, counts = part[:-1].split("(", 1)
+            values = [int(value) for value in counts.split(",")]
+            repeat = (values[0], values[-1])
+            if len(values) > 2 or repeat[0] > repeat[1]:
+                raise ValueError("Invalid repeat in PROSITE element: " + part + "(" + counts + ")")
+        table = np.zeros(256, dtype=bool)
+        if part == "x":
+            table[:] = True
+        elif part.startswith("[") and part.endswith("]"):
+            letters = part[1:-1]
+            if letters.endswith(">"):
+                if not last:
+                    raise ValueError("'>' is only allowed in the last element of a PROSITE pattern")
+                self.end_choice = True
+                letters = letters[:-1]
+            table[[ord(letter) for letter in letters]] = True
+        elif part.startswith("{") and part.endswith("}"):
+            table[:] = True
+            table[[ord(letter) for letter in part[1:-1]]] = False
+        elif len(part) == 1 and part.isalpha():
+            table[ord(part)] = True
+        else:
+            raise ValueError("Invalid PROSITE element: " + part)
+        # Byte 0 separates the sequences of a chunk, no element matches it, so no match can run from one sequence into the next
+        table[0] = False
+        return table, repeat[0], repeat[1]
+
+    def longest_ends(self, text):
+
+        # For every position of text (sequences separated by 0 bytes), the end (exclusive) of the longest match starting there, or -1
+        # ends[p] starts as "a match may end at p" and goes through the elements backwards: an element repeated r times can be matched
+        # ... from p when its class matches text[p], ..., text[p + r - 1] and the rest of the pattern matches from p + r
+
+        size = len(text)
+        positions = np.arange(size + 1, dtype=np.int32 if size < 2 ** 31 - 1 else np.int64)
+        separators = np.append(text == 0, True)
+        ends = np.where(separators, positions, -1) if self.anchored_end else positions.copy()
+        for number in range(len(self.elements) - 1, -1, -1):
+            table, minimum, maximum = self.elements[number]
+            matches = np.take(table, text)
+            best = ends.copy() if minimum == 0 else np.full(size + 1, -1, dtype=positions.dtype)
+            current = ends
+            for repeat in range(1, maximum + 1):
+                shifted = np.full(size + 1, -1, dtype=positions.dtype)
+                shifted[:size] = np.where(matches, current[1:], -1)
+                current = shifted
+                if repeat >= minimum:
+                    best = np.maximum(best, current)
+                if current.max() < 0:
+                    break
+            if number == len(self.elements) - 1 and self.end_choice:
+                # [..>]: the last element can also be the C-terminal end itself
+                best = np.maximum(best, np.where(separators, positions, -1))
+            ends = best
+        return ends[:size]
+
+    def scan_corpus(self, corpus):
+
+        # Every hit in a SequenceCorpus (or a list of sequences), as (sequence id, start, end) sorted by sequence and start
+        # The sequence id is the corpus id when the corpus has ids, otherwise the sequence number
+
+        if not isinstance(corpus, SequenceCorpus):
+            corpus = SequenceCorpus.from_sequences(corpus)
+        residues = np.asarray(corpus.residues)
+        offsets = np.asarray(corpus.offsets) - corpus.offsets[0]
+        count = len(corpus)
+        # Sequence i starts at offsets[i] + i in the text, followed by a 0 byte
+        text = np.zeros(len(residues) + count, dtype=np.uint8)
+        text[np.arange(len(residues)) + corpus.sequence_index()] = residues
+        starts = offsets[:-1] + np.arange(count)
+        ends = self.longest_ends(text)
+        hit_starts = np.flatnonzero(ends > np.arange(len(text)))
+        if self.anchored_start:
+            hit_starts = np.intersect1d(hit_starts, starts)
+        sequences = np.searchsorted(starts, hit_starts, side="right") - 1
+        ids = corpus.ids[sequences].tolist() if corpus.ids is not None else sequences.tolist()
+        first = (hit_starts - starts[sequences] + 1).tolist()
+        last = (ends[hit_starts] - starts[sequences]).tolist()
+        return list(zip(ids, first, last))
+
+    def search(self, sequence):
+
+        # Hits in one sequence as (start, end) tuples, like Naive / KMP
+
+        return [(start, end) for sequence_id, start, end in self.scan_corpus([sequence])]
+
+def compile_prosite(pattern):
+    return PrositePattern(pattern)
+
+def prosite_search(pattern, sequence):
+    return PrositePattern(pattern).search(sequence)
+
+def prosite_scan(pattern, source, chunk_size=10000, workers=1):
+
+    # Generator of (sequence id, start, end) hits of a PROSITE pattern over a whole dataset, in input order
+    # source is a FASTA file name, a SequenceCorpus or an iterable of sequences / records (see characterization.source_chunks)
+    # The dataset is scanned chunk by chunk, on `workers` processes (0 = one per CPU)
+
+    if not isinstance(pattern, PrositePattern):
+        pattern = PrositePattern(pattern)
+    for hits in parallel.ordered_map(pattern.scan_corpus, characterization.source_chunks(source, chunk_size), workers):
+        for hit in hits:
+            yield hit
+
+class ApproximatePattern:
+
+    # Approximate search of a pattern of up to 64 residues, allowing up to k mismatches (mode="mismatch") or k edits (mode="edit")
+    # The pattern is one 64-bit word per state, updated with bit operations for every residue (bit-parallel):
+    # - mismatches use the shift-or automaton of Wu and Manber, with one state word per number of errors 0..k
+    # - edits use the bit-vector edit distance of Myers, which tracks the best distance of the pattern ending at every residue
+    # All the sequences of a corpus chunk are stepped in lockstep (residue 1 of every sequence, then residue 2, ...), so every
+    # ... bit operation is a NumPy operation over a whole array of state words, one per sequence
+    # classes optionally lists residues to treat as equivalent, e.g. ["ILV", "DE", "KR"]: I in the pattern then also matches L or V
+    # Hits are (start, end, distance), 1-based inclusive like Naive / KMP, for every end position with at most k errors
+    # For edits, start is the leftmost start of a best alignment ending there
+
+    def __init__(self, pattern, k=1, mode="mismatch", classes=None):
+        if not 0 < len(pattern) <= 64:
+            raise ValueError("Approximate patterns must have 1 to 64 residues")
+        if mode not in ("mismatch", "edit"):
+            raise ValueError("Unknown mode: " + str(mode))
+        if not 0 <= k < len(pattern):
+            raise ValueError("k must be between 0 and the pattern length - 1")
+        self.pattern = pattern
+        self.k = k
+        self.mode = mode
+        equivalents = {}
+        for residue_class in classes or []:
+            for residue in residue_class:
+                equivalents[residue] = equivalents.get(residue, "") + residue_class
+        # peq[c] has bit j set when residue c matches pattern[j]
+        peq = [0] * 256
+        for j, residue in enumerate(pattern):
+            for letter in set(equivalents.get(residue, "") + residue):
+                peq[ord(letter)] |= 1 << j
+        self.peq = np.array(peq, dtype=np.uint64)
+
+    def mismatch_step(self, states, eq):
+
+        # Wu-Manber shift-or with 0 meaning "matched so far": a residue matching pattern[j] keeps the bit, any other adds a mismatch
+
+        one = np.uint64(1)
+        mismatches = ~eq
+        previous = states[0]
+        states[0] = (states[0] << one) | mismatches
+        for d in range(1, len(states)):
+            current = states[d]
+            states[d] = ((current << one) | mismatches) & (previous << one)
+            previous = current
+
+    def scan_corpus(self, corpus):
+
+        # Every hit in a SequenceCorpus (or a list of sequences), as (sequence id, start, end, distance) sorted by sequence, end and start
+
+        if not isinstance(corpus, SequenceCorpus):
+            corpus = SequenceCorpus.from_sequences(corpus)
+        residues = np.asarray(corpus.residues)
+        offsets = np.asarray(corpus.offsets) - corpus.offsets[0]
+        lengths = np.diff(offsets)
+        # Longest sequences first, so the sequences still running at residue j are always a prefix of the arrays
+        order = np.argsort(-lengths, kind="stable")
+        starts = offsets[:-1][order]
+        # running[j] is the number of sequences longer than j
+        running = np.searchsorted(-lengths[order], -np.arange(int(lengths.max(initial=0))), side="left")
+        m = len(self.pattern)
+        high = np.uint64(1 << (m - 1))
+        count = len(corpus)
+        found = []
+
+        if self.mode == "mismatch":
+            states = [np.full(count, ~np.uint64(0) << np.uint64(d), dtype=np.uint64) for d in range(self.k + 1)]
+            for j, active in enumerate(running.tolist()):
+                eq = self.peq[residues[starts[:active] + j]]
+                states_active = [state[:active] for state in states]
+                self.mismatch_step(states_active, eq)
+                for d in range(self.k + 1):
+                    states[d][:active] = states_active[d]
+                if j < m - 1:
+                    continue
+                distance = np.full(active, -1)
+                for d in range(self.k, -1, -1):
+                    distance = np.where((states_active[d] & high) == 0, d, distance)
+                hits = np.flatnonzero(distance >= 0)
+                found.append((hits, np.full(len(hits), j + 1), distance[hits]))
+        else:
+            pv = np.full(count, ~np.uint64(0), dtype=np.uint64)
+            mv = np.zeros(count, dtype=np.uint64)
+            score = np.full(count, m)
+            one = np.uint64(1)
+            for j, active in enumerate(running.tolist()):
+                eq = self.peq[residues[starts[:active] + j]]
+                p = pv[:active]
+                n = mv[:active]
+                xv = eq | n
+                xh = (((eq & p) + p) ^ p) | eq
+                ph = n | ~(xh | p)
+                mh = p & xh
+                score[:active] += (ph & high != 0).astype(score.dtype) - (mh & high != 0).astype(score.dtype)
+                ph = ph << one
+                mh = mh << one
+                pv[:active] = mh | ~(xv | ph)
+                mv[:active] = ph & xv
+                hits = np.flatnonzero(score[:active] <= self.k)
+                found.append((hits, np.full(len(hits), j + 1), score[:active][hits]))
+
+        if found:
+            sequences = np.concatenate([hits for hits, ends, distances in found])
+            ends = np.concatenate([ends for hits, ends, distances in found])
+            distances = np.concatenate([distances for hits, ends, distances in found])
+        else:
+            sequences = ends = distances = np.zeros(0, dtype=np.int64)
+        if self.mode == "mismatch":
+            first = ends - m + 1
+        else:
+            first = self.alignment_starts(residues, starts[sequences], ends, distances)
+        sequences = order[sequences]
+        hit_order = np.lexsort((first, ends, sequences))
+        ids = corpus.ids[sequences[hit_order]].tolist() if corpus.ids is not None else sequences[hit_order].tolist()
+        return list(zip(ids, first[hit_order].tolist(), ends[hit_order].tolist(), distances[hit_order].tolist()))
+
+    def alignment_starts(self, residues, sequence_starts, ends, distances):
+
+        # Leftmost 1-based start of an alignment of the pattern with `distance` edits ending at every hit (edit distance table,
+        # ... filled backwards from the end of the hit, one column per residue, for all the hits at once)
+
+        m = len(self.pattern)
+        size = len(ends)
+        previous = np.tile(np.arange(m + 1), (size, 1))
+        first = ends.copy()
+        infinity = 2 * m + 2
+        for j in range(1, m + self.k + 1):
+            position = ends - j
+            valid = position >= 0
+            eq = self.peq[residues[sequence_starts + np.maximum(position, 0)]]
+            column = np.empty_like(previous)
+            # Row 0: the j residues are all insertions
+            column[:, 0] = j
+            for i in range(1, m + 1):
+                # Row i aligns the last i residues of the pattern
+                match = ((eq >> np.uint64(m - i)) & np.uint64(1)).astype(bool)
+                column[:, i] = np.minimum(np.minimum(previous[:, i - 1] + (~match).astype(previous.dtype), previous[:, i] + 1), column[:, i - 1] + 1)
+            column[~valid] = infinity
+            first = np.where(column[:, m] == distances, position + 1, first)
+            previous = column
+        return first
+
+    def search(self, sequence):
+
+        # Hits in one sequence as (start, end, distance) tuples
+
+        return [(start, end, distance) for sequence_id, start, end, distance in self.scan_corpus([sequence])]
+
+def approximate_search(pattern, sequence, k=1, mode="mismatch", classes=None):
+    return ApproximatePattern(pattern, k, mode, classes).search(sequence)
+
+def approximate_scan(pattern, source, k=1, mode="mismatch", classes=None, chunk_size=10000, workers=1):
+
+    # Generator of (sequence id, start, end, distance) hits of an approximate pattern over a whole dataset, in input order
+    # source is a FASTA file name, a SequenceCorpus or an iterable of sequences / records (see characterization.source_chunks)
+
+    matcher = ApproximatePattern(pattern, k, mode, classes)
+    for hits in parallel.ordered_map(matcher.scan_corpus, characterization.source_chunks(source, chunk_size), workers):
+        for hit in hits:
+            yield hit
+
+# Uniform hit record of search_dataset: 1-based inclusive start / end like Naive / KMP, distance is 0 for the exact algorithms
+Hit = namedtuple("Hit", ["id", "pattern", "start", "end", "distance"])
+
+exact_algorithms = {"naive": Naive, "boyer_moore": BoyerMoore, "kmp": KMP}
+
+def matches_or_empty(matches):
+
+    # BoyerMoore returns -1 when there is no match, where Naive and KMP return an empty list
+
+    return [] if matches == -1 else matches
+
+class SearchTask:
+
+    # Searches the patterns in one SequenceCorpus chunk with one of the algorithms of this module, returning a list of Hits
+    # algorithm is "naive", "boyer_moore", "kmp" (one scan per sequence and pattern), "aho_corasick" (one scan per sequence for all patterns),
+    # ... "prosite" (PROSITE patterns) or "approximate" (options such as k, mode and classes are given to ApproximatePattern)
+    # The patterns are compiled once, and the task is picklable, so it can run in worker processes (see search_dataset)
+    # Hits are ordered by sequence, start, end and pattern (in the order of patterns)
+
+    def __init__(self, algorithm, patterns, **options):
+        if algorithm not in ("aho_corasick", "prosite", "approximate") and algorithm not in exact_algorithms:
+            raise ValueError("Unknown search algorithm: " + str(algorithm))
+        self.algorithm = algorithm
+        self.patterns = [patterns] if isinstance(patterns, str) else list(patterns)
+        self.pattern_numbers = {pattern: number for number, pattern in reversed(list(enumerate(self.patterns)))}
+        if algorithm == "aho_corasick":
+            self.matchers = [AhoCorasick(self.patterns)]
+        elif algorithm == "prosite":
+            self.matchers = [PrositePattern(pattern) for pattern in self.patterns]
+        elif algorithm == "approximate":
+            self.matchers = [ApproximatePattern(pattern, **options) for pattern in self.patterns]
+        else:
+            self.matchers = []
+
+    def __call__(self, chunk):
+        found = []
+        if self.algorithm in exact_algorithms:
+            function = exact_algorithms[self.algorithm]
+            for i, sequence in enumerate(chunk):
+                for number, pattern in enumerate(self.patterns):
+                    for start, end in matches_or_empty(function(pattern, sequence)):
+                        found.append((i, start, end, number, 0))
+        elif self.algorithm == "aho_corasick":
+            for i, sequence in enumerate(chunk):
+                for pattern, start, end in self.matchers[0].search(sequence):
+                    found.append((i, start, end, self.pattern_numbers[pattern], 0))
+        else:
+            # Without ids, scan_corpus reports sequence numbers within the chunk
+            numbered = SequenceCorpus(chunk.residues, chunk.offsets)
+            for number, matcher in enumerate(self.matchers):
+                for hit in matcher.scan_corpus(numbered):
+                    found.append((hit[0], hit[1], hit[2], number, hit[3] if len(hit) > 3 else 0))
+        found.sort()
+        ids = np.asarray(chunk.ids).tolist() if chunk.ids is not None else range(len(chunk))
+        return [Hit(ids[i], self.patterns[number], start, end, distance)
+                for i, start, end, number, distance in found]
+
+def search_dataset(patterns, source, algorithm="kmp", chunk_size=1000, workers=1, **options):
+
+    # Generator of the Hits of one or several patterns over a whole dataset, with any algorithm of SearchTask
+    # source is a FASTA file name, a SequenceCorpus or an iterable of sequences / records (see characterization.source_chunks)
+    # The dataset is split in chunks of chunk_size sequences, searched on `workers` processes (0 = one per CPU) while it is read;
+    # ... the hits of every chunk are yielded as soon as it and the ones before it are done, so the order is the same for any number of workers:
+    # ... input order of the sequences, then start, end and pattern
+
+    task = SearchTask(algorithm, patterns, **options)
+    for hits in parallel.ordered_map(task, characterization.source_chunks(source, chunk_size), workers):
+        for hit in hits:
+            yield hit
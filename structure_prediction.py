@@ -1,6 +1,9 @@
 import math
 import numpy as np
 import matplotlib.pyplot as plt
+import feature_cache
+import characterization
+from corpus import SequenceCorpus
 
 
 # Dictionaries that store Chou and Fasman's Parameters
@@ -13,6 +16,7 @@ beta_propensity_dictionary = {"A": [0, 0.83], "C": [1, 1.19], "D": [-1, 0.54], "
                                   "M": [0.5, 1.05], "N": [0, 0.89], "P": [-1, 0.55], "Q": [0.5, 1.10], "R": [0, 0.93],
                                   "S": [0, 0.75], "T": [1, 1.19], "W": [1, 1.37], "V": [1, 1.70], "Y": [1, 1.47]}
 
+@feature_cache.cached("get_secondary_structures_by_chou_and_fasman")
 def get_secondary_structures_by_chou_and_fasman(seq):
 
     # Main function to get alpha helices and beta sheets using Chou and Fasman's propensity method
@@ -187,6 +191,7 @@ def modify_chou_and_fasman(seq):
 
     return d
 
+@feature_cache.cached("generate_DSSP_sequence")
 def generate_DSSP_sequence(seq):
 
     # This function mainly iterates over the sequence and compares the alpha/beta propensity values of each amino acid
@@ -367,42 +372,104 @@ def plot_ramachandran(list_of_phi_psi):
             plt.scatter(dihedral[0], dihedral[1], color='blue')
     plt.show()
 
+def charge_scale(pH=7):
+
+    # Side chain charge of the 21 residues of characterization at a pH, as given by side_chain_charge (0 for the non-ionizable ones)
+
+    return {aa: characterization.side_chain_charge(aa, pH) for aa in characterization.amino_acid_list}
+
+# Residue scales available to property_profile by name
+# The Kyte-Doolittle hydrophobicity of characterization, its side chain charges (step model, see charge_scale)
+# ... and the Chou and Fasman helix / sheet propensities of the dictionaries above
+profile_scales = {"hydrophobicity": characterization.aa_hydrophobicity,
+                  "charge": charge_scale(7),
+                  "alpha": {aa: value[1] for aa, value in alpha_propensity_dictionary.items()},
+                  "beta": {aa: value[1] for aa, value in beta_propensity_dictionary.items()}}
+
+def scale_table(scale):
+
+    # 256-entry lookup table (indexed by ASCII code) of a scale given by name (see profile_scales) or as a residue --> value dictionary
+    # Residues that are not in the scale are NaN
+
+    if isinstance(scale, str):
+        scale = profile_scales[scale]
+    table = np.full(256, np.nan)
+    for aa, value in scale.items():
+        table[ord(aa)] = value
+    return table
+
+def window_means(values, window):
+
+    # Mean of every window of 2 * (window // 2) + 1 consecutive values, in O(n) from a cumulative sum
+    # Entry j is the window centred on values[j + window // 2]; windows containing a NaN (a residue without a value) are NaN
+
+    span = 2 * (window // 2) + 1
+    known = ~np.isnan(values)
+    sums = np.concatenate(([0], np.cumsum(np.where(known, values, 0))))
+    unknown = np.concatenate(([0], np.cumsum(~known)))
+    means = (sums[span:] - sums[:-span]) / span
+    return np.where(unknown[span:] - unknown[:-span] > 0, np.nan, means)
+
+def property_profile(protein_seq, scale="hydrophobicity", window=1):
+
+    # Smoothed profile of a residue scale along a protein sequence, without plotting anything (see plot_profile for that)
+    # Returns (positions, values) arrays: values[k] is the mean of the scale over the window centred on residue positions[k] (0-based)
+    # Like plot_hydrophobicity_profile, only the residues with a full window are profiled, window // 2 residues are left out at each end
+    # An even window is widened to the next odd one, so every window is centred
+
+    if window < 1:
+        raise ValueError("The window must be at least 1")
+    half_window = window // 2
+    values = np.take(scale_table(scale), np.frombuffer(protein_seq.encode("ascii", errors="replace"), dtype=np.uint8))
+    if len(values) < 2 * half_window + 1:
+        return np.arange(0), np.zeros(0)
+    return np.arange(half_window, len(values) - half_window), window_means(values, window)
+
+def property_profiles(list_of_sequences, scale="hydrophobicity", window=1):
+
+    # Batch mode of property_profile over a list of sequences or a SequenceCorpus (e.g. a whole proteome), yielding (positions, values) for every sequence in order
+    # Every chunk of sequences is looked up and smoothed at once on its packed residues:
+    # ... a centred window with a full window inside its sequence never crosses into the next one, so the windows that do are just skipped
+
+    if window < 1:
+        raise ValueError("The window must be at least 1")
+    half_window = window // 2
+    table = scale_table(scale)
+    chunks = list_of_sequences.chunks() if isinstance(list_of_sequences, SequenceCorpus) else characterization.sequence_chunks(list_of_sequences)
+    for chunk in chunks:
+        offsets = np.asarray(chunk.offsets) - chunk.offsets[0]
+        values = np.take(table, np.asarray(chunk.residues))
+        means = window_means(values, window) if len(values) >= 2 * half_window + 1 else np.zeros(0)
+        for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            if stop - start < 2 * half_window + 1:
+                yield np.arange(0), np.zeros(0)
+            else:
+                # means[j] is centred on residue j + half_window of the chunk
+                yield np.arange(half_window, stop - start - half_window), means[start:stop - 2 * half_window]
+
+def plot_profile(positions, values, title="Property Profile", ylabel="Property value", show=True):
+
+    # Plots a profile computed by property_profile; show=False leaves the figure open (e.g. to save it with plt.savefig)
+
+    plt.title(title)
+    plt.xlabel('Amino acid sequence')
+    plt.ylabel(ylabel)
+    plt.plot(positions, values)
+    if show:
+        plt.show()
+
 def plot_hydrophobicity_profile(protein_seq, smoothing_window=1):
 
     # This function serves to plot a hydrophobicity profile for a protein sequence
     # X axis has the amino acids, sequentially arranged
     # Y axis has the hydrophobic value for that particular amino acid
     # These dots are then connected to form the hydrophobic profile
-
-    import matplotlib.pyplot as plt
-    aa_hydrophobicity = {'I': 4.50, 'V': 4.20, 'L': 3.80, 'F': 2.80, 'C': 2.50, 'M': 1.90, 'A': 1.80, 'G': -0.40, 'T': -0.70, 'S': -0.80,
-                         'W': -0.90,'Y': -1.30, 'P': -1.60, 'H': -3.20, 'E': -3.50, 'N': -3.50, 'Q': -3.50, 'D': -3.50, 'K': -3.90, 'R': -4.50}
-    plt.title('Hydrophobicity Profile')
-    plt.xlabel('Amino acid sequence')
-
-    x_values = []
-    y_values = []
-    if smoothing_window == 1:
-        plt.ylabel('Hydrophobicity index')
-        for aa in range(len(protein_seq)):
-            x_values.append(aa)
-            y_values.append(aa_hydrophobicity[protein_seq[aa]])
-        plt.plot(x_values, y_values)
-
     # Smoothing window plots the average hydrophobicity value of the amino acids within the odd window
-
-    elif smoothing_window > 1:
-        for aa in range(len(protein_seq)):
-            y_values.append(aa_hydrophobicity[protein_seq[aa]])
-        half_window = smoothing_window//2
-        plt.ylabel('Hydrophobicity index (window = %d)' % smoothing_window)
-        y_average = []
-        for i in range(half_window, len(protein_seq)-half_window):
-            average = 0.0
-            x_values.append(i)
-            for j in range(-half_window, half_window+1):
-                average += y_values[i+j]
-            y_average.append(average/smoothing_window)
-        plt.plot(x_values, y_average)
-    plt.show()
-    
\ No newline at end of file
+    # The profile itself is computed by property_profile
+
+    positions, values = property_profile(protein_seq, "hydrophobicity", smoothing_window)
+    if smoothing_window > 1:
+        ylabel = 'Hydrophobicity index (window = %d)' % smoothing_window
+    else:
+        ylabel = 'Hydrophobicity index'
+    plot_profile(positions, values, 'Hydrophobicity Profile', ylabel)
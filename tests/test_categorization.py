@@ -0,0 +1,30 @@
+import numpy as np
+import characterization as c
+import categorization as ca
+from corpus import SequenceCorpus
+
+def test_feature_matrix_keeps_every_row_of_long_chunks():
+    # 1000 sequences of 5000 residues: one list chunk of over 2^22 residues, which the spectra split in two
+    proteins = ["A" * 4999 + "C"] * 1000
+    matrix = ca.feature_matrix(proteins, "dipeptide")
+    assert matrix.shape == (1000, len(c.kmer_names(2)))
+    names = ca.feature_names("dipeptide")
+    expected = c.pair_composition(proteins[0])
+    assert np.all(matrix[:, names.index("AA")] == expected["AA"])
+    assert np.all(matrix[:, names.index("AC")] == expected["AC"])
+
+def test_feature_matrix_matches_per_protein_compositions():
+    generator = np.random.default_rng(0)
+    letters = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWYU", dtype=np.uint8)
+    proteins = [letters[generator.integers(0, len(letters), generator.integers(1, 80))].tobytes().decode("ascii") for _ in range(300)]
+    expected = [list(c.AA_Composition(seq)[aa] for aa in c.amino_acid_list) + list(c.pair_composition(seq).values()) for seq in proteins]
+    assert np.array_equal(ca.feature_matrix(proteins, "both"), np.array(expected))
+    assert np.array_equal(ca.feature_matrix(SequenceCorpus.from_sequences(proteins), "both"), np.array(expected))
+
+def test_l1_distances_match_the_dense_computation():
+    generator = np.random.default_rng(1)
+    centroids = generator.random((20, 462))
+    queries = generator.random((50, 462))
+    classifier = ca.CentroidClassifier(centroids, ["class " + str(i) for i in range(20)], "both")
+    expected = np.abs(queries[:, None, :] - centroids[None, :, :]).sum(axis=2)
+    assert np.allclose(classifier.distances(queries, "l1", block_size=16), expected)
@@ -0,0 +1,61 @@
+import random
+import pytest
+import characterization as c
+from corpus import SequenceCorpus
+
+def random_proteins(count, seed):
+    generator = random.Random(seed)
+    return ["".join(generator.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(generator.randint(20, 400))) for _ in range(count)]
+
+def report_values(file_name):
+    values = {}
+    with open(file_name) as report:
+        for line in report:
+            if ": " in line:
+                label, value = line.rstrip("\n").split(": ", 1)
+                values[label] = value.split(" and their percentage: ")
+    return values
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_export_averages_match_average_functions(tmp_path, seed):
+    proteins = random_proteins(1000, seed)
+    file_name = str(tmp_path / "report.txt")
+    c.export(proteins, "random", file_name, num=len(proteins), chunk_size=300)
+    report = report_values(file_name)
+    assert float(report["Average protein length"][0]) == c.average_protein_length(proteins)
+    assert float(report["Average protein molecular weight"][0]) == c.Avg_molecular_weight(proteins)
+    assert float(report["Average protein net charge at pH = 7"][0]) == c.average_total_charge(proteins)
+    assert float(report["Average protein isoelectric point"][0]) == c.average_isoelectric_point(proteins)
+    assert float(report["Average protein hydrophobicity"][0]) == c.get_average_hydrophobicity(proteins)
+    assert float(report["Average protein hydrophobicity"][0]) == c.get_average_hydrophobicity(SequenceCorpus.from_sequences(proteins))
+    for label, number, percent in [("positively charged", c.average_num_positive_charge, c.average_percent_positive_charge),
+                                   ("aromatic", c.average_num_aromatic, c.average_percent_aromatic)]:
+        assert float(report["Average number of " + label + " residues"][0]) == number(proteins)
+        assert float(report["Average number of " + label + " residues"][1]) == percent(proteins)
+
+def test_export_composition_matches_avg_composition(tmp_path):
+    proteins = random_proteins(1000, 3)
+    file_name = str(tmp_path / "report.txt")
+    c.export(proteins, "random", file_name, num=len(proteins), chunk_size=300)
+    composition = c.Avg_Composition(proteins)
+    with open(file_name) as report:
+        rows = [line.split("\t") for line in report if line.count("\t") == 2 and not line.startswith("AA")]
+    assert len(rows) == 20
+    for aa, occurence, percent in rows:
+        assert float(percent) == composition[aa]
+
+def test_export_of_an_empty_dataset(tmp_path):
+    with pytest.raises(ValueError):
+        c.export([], "empty", str(tmp_path / "report.txt"), num=0)
+
+@pytest.mark.parametrize("seed", [8, 217, 279])
+def test_average_hydrophobicity_uses_the_export_reduction(tmp_path, seed):
+    # Datasets where a float sum of the rounded totals and the fixed point sum of export used to round differently
+    generator = random.Random(seed)
+    count = generator.randint(2, 60)
+    proteins = ["".join(generator.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(generator.randint(20, 400))) for _ in range(count)]
+    file_name = str(tmp_path / "report.txt")
+    c.export(proteins, "random", file_name, num=count)
+    exported = float(report_values(file_name)["Average protein hydrophobicity"][0])
+    assert exported == c.get_average_hydrophobicity(proteins)
+    assert exported == c.get_average_hydrophobicity(SequenceCorpus.from_sequences(proteins))
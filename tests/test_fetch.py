@@ -0,0 +1,38 @@
+import io
+import fetch
+
+FASTA = (b">sp|P21796|VDAC1_HUMAN Voltage-dependent anion-selective channel protein 1\n"
+         b"MAVPPTYADLGKSARDVFTKGYGFGLIKLDLKTKSENGLEF\n"
+         b"TSSGSANTETTKVTGSLETKYRWTEYGLTFTEKWNTDNTL\n"
+         b">tr|Q9Y277|VDAC3_HUMAN Voltage-dependent anion-selective channel protein 3\n"
+         b"MCNTPTYCDLGKAAKDVFNKGYGFGMVKIDLKTKSCSGVEF\n"
+         b">plain description only\n"
+         b"ACDEFGHIK\n")
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def test_one_byte_chunks_parse_like_whole_lines():
+    expected = list(fetch.records_from_lines(FASTA.decode("utf-8").splitlines()))
+    assert [record.accession for record in expected] == ["P21796", "Q9Y277", "plain"]
+    assert list(fetch.records_from_chunks(split(FASTA, 1))) == expected
+
+def test_record_split_across_chunk_boundary():
+    expected = list(fetch.records_from_chunks([FASTA]))
+    # Cut in the middle of the second header, then in the middle of its sequence line
+    second = FASTA.index(b">tr|")
+    chunks = [FASTA[:second + 5], FASTA[second + 5:second + 100], FASTA[second + 100:]]
+    assert list(fetch.records_from_chunks(chunks)) == expected
+    assert expected[1].sequence == "MCNTPTYCDLGKAAKDVFNKGYGFGMVKIDLKTKSCSGVEF"
+
+def test_every_split_point_and_missing_final_newline():
+    data = FASTA.rstrip(b"\n")
+    expected = list(fetch.records_from_chunks([data]))
+    for cut in range(len(data) + 1):
+        assert list(fetch.records_from_chunks([data[:cut], b"", data[cut:]])) == expected
+
+def test_tee_keeps_the_raw_bytes():
+    tee = io.BytesIO()
+    records = list(fetch.records_from_chunks(split(FASTA, 7), tee=tee))
+    assert tee.getvalue() == FASTA
+    assert len(records) == 3
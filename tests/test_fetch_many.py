@@ -0,0 +1,129 @@
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import fetch
+import http_cache
+
+class StandIn(BaseHTTPRequestHandler):
+
+    # Local UniProt stand-in: /ok/<id>.fasta answers a record for id, /flaky/<id>.fasta answers 503 twice first,
+    # ... /busy/<id>.fasta answers 429 with Retry-After once first
+    # Every request is recorded with its time, and the number of requests running at once is tracked
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, time.monotonic()))
+            server.running += 1
+            server.max_running = max(server.max_running, server.running)
+            attempts = server.attempts[self.path] = server.attempts.get(self.path, 0) + 1
+        try:
+            time.sleep(server.delay)
+            kind, name = self.path.strip("/").split("/")
+            identifier = name[:-len(".fasta")]
+            if kind == "flaky" and attempts <= 2:
+                self.answer(503, b"unavailable")
+            elif kind == "busy" and attempts == 1:
+                self.answer(429, b"slow down", {"Retry-After": "0"})
+            else:
+                self.answer(200, (">sp|" + identifier + "|TEST_HUMAN test\nMACDE\n").encode("utf-8"))
+        finally:
+            with server.lock:
+                server.running -= 1
+
+    def answer(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.attempts = {}
+    httpd.running = 0
+    httpd.max_running = 0
+    httpd.delay = 0
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    httpd.url = "http://127.0.0.1:" + str(httpd.server_address[1])
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_retry_on_503(server):
+    with fetch.make_session() as session:
+        response = fetch.get_with_retry(session, server.url + "/flaky/P1.fasta", backoff=0.01, use_cache=False)
+    assert response.status_code == 200
+    assert server.attempts["/flaky/P1.fasta"] == 3
+
+def test_retries_exhausted_returns_last_error(server):
+    with fetch.make_session() as session:
+        response = fetch.get_with_retry(session, server.url + "/flaky/P2.fasta", retries=1, backoff=0.01, use_cache=False)
+    assert response.status_code == 503
+    assert server.attempts["/flaky/P2.fasta"] == 2
+
+def test_batch_returns_every_id(server):
+    ids = ["P" + str(i) for i in range(40)]
+    results = list(fetch.fetch_many(ids, server.url + "/ok/{}.fasta", max_workers=4, rate=None, use_cache=False))
+    assert sorted(result.id for result in results) == sorted(ids)
+    for result in results:
+        assert result.error is None
+        assert result.result.accession == result.id
+        assert result.result.sequence == "MACDE"
+
+def test_batch_retries_and_concurrency_cap(server):
+    server.delay = 0.02
+    ids = ["Q" + str(i) for i in range(24)]
+    template = server.url + "/busy/{}.fasta"
+    results = {result.id: result for result in fetch.fetch_many(ids, template, max_workers=3, rate=None, backoff=0.01, use_cache=False)}
+    assert set(results) == set(ids)
+    assert all(result.error is None for result in results.values())
+    assert all(server.attempts["/busy/" + identifier + ".fasta"] == 2 for identifier in ids)
+    assert server.max_running <= 3
+
+def test_errors_are_reported_not_raised(server):
+    results = list(fetch.fetch_many(["P1"], server.url + "/flaky/{}.fasta", retries=0, rate=None, use_cache=False))
+    assert results[0].result is None
+    assert results[0].error is not None
+
+def test_rate_limit(server):
+    rate = 20
+    ids = ["R" + str(i) for i in range(11)]
+    list(fetch.fetch_many(ids, server.url + "/ok/{}.fasta", max_workers=8, rate=rate, burst=1, use_cache=False))
+    times = sorted(moment for path, moment in server.requests)
+    # One token at a time: the 11 requests are spread over at least 10 token periods
+    assert times[-1] - times[0] >= 10 / rate * 0.9
+
+def test_rate_limiter_burst():
+    limiter = fetch.RateLimiter(rate=50, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start >= 5 / 50 * 0.9
+
+def test_cached_rerun_is_not_rate_limited(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(http_cache, "_default_cache", http_cache.HttpCache(str(tmp_path)))
+    rate = 10
+    ids = ["C" + str(i) for i in range(30)]
+    template = server.url + "/ok/{}.fasta"
+    cold = list(fetch.fetch_many(ids, template, max_workers=4, rate=rate, burst=1))
+    assert len(server.requests) == len(ids)
+    start = time.monotonic()
+    warm = list(fetch.fetch_many(ids, template, max_workers=4, rate=rate, burst=1))
+    elapsed = time.monotonic() - start
+    # Every response comes from the cache: no request reaches the server and no token is waited for
+    assert len(server.requests) == len(ids)
+    assert elapsed < len(ids) / rate / 10
+    assert sorted(result.result for result in warm) == sorted(result.result for result in cold)